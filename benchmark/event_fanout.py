@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import argparse
+from heart import client
+from misc import message as msg
+
+
+class NullWebSocket:
+    """
+    Stand-in websocket that accepts every frame immediately, so only the heart's own cost is measured
+    """
+    subprotocol = None
+    remote_address = ('127.0.0.1', 0)
+
+    async def send(self, frame):
+        pass
+
+
+async def per_subscriber_encode(context, event):
+    """
+    Fan-out before encode-once broadcast. Every subscriber encodes the event again
+    """
+    await asyncio.gather(*[sub.websocket.send(str(event)) for sub in context.registration.subscribers])
+
+
+async def measure(handler, context, event, number):
+    start = time.perf_counter()
+
+    for _ in range(number):
+        await handler(context, event)
+        await asyncio.sleep(0)
+
+    return time.perf_counter() - start
+
+
+async def run(number):
+    event = msg.Event('SwitchScenes', **{'scene-name': 'Live', 'sources': [{'name': f'Source {i}'} for i in range(20)]})
+    apps = {}
+    connections = set()
+    publisher = client.Client(0, None, NullWebSocket(), apps, connections)
+    publisher.add_application('OBS Studio')
+
+    print(f"{'subscribers':>12}{'before events/s':>18}{'after events/s':>18}{'speedup':>10}")
+
+    for subscribers in (1, 10, 100):
+        while len(publisher.registration.subscribers) < subscribers:
+            subscriber = client.Client(len(publisher.registration.subscribers) + 1, None, NullWebSocket(), apps,
+                                       connections)
+            subscriber.add_subscription('OBS Studio')
+            subscriber.outbound.start()
+
+        n = max(number // subscribers, 10)
+        before = await measure(per_subscriber_encode, publisher, event, n)
+        after = await measure(client.handle_event, publisher, event, n)
+        print(f"{subscribers:>12}{n / before:>18,.0f}{n / after:>18,.0f}{before / after:>9.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of event fan-out from one application to its subscribers')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='Events per run for 1 subscriber')
+    args = parser.parse_args()
+
+    asyncio.run(run(args.number))
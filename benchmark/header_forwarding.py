@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import timeit
+import argparse
+from misc import message as msg
+
+
+def scene_list_response(scenes, sources):
+    """
+    GetSceneList response from obs-websocket 4.x with the given number of scenes and sources per scene
+    """
+    return json.dumps({
+        'message-id': '17', 'status': 'ok', 'current-scene': 'Scene 0',
+        'scenes': [{'name': f'Scene {i}', 'sources': [
+            {'id': 'ffmpeg_source', 'name': f'Source {i}-{j}', 'type': 'input', 'render': True, 'muted': False,
+             'locked': False, 'volume': 1.0, 'cx': 1920.0, 'cy': 1080.0, 'x': 0.0, 'y': 0.0,
+             'source_cx': 1920, 'source_cy': 1080, 'alignment': 5} for j in range(sources)]}
+            for i in range(scenes)]})
+
+
+def full_decode(frame):
+    response = msg.check_message(frame)
+    response.id = 3
+    return str(response)
+
+
+def header_only(frame):
+    response = msg.peek_header(frame)
+    response.id = 3
+    return str(response)
+
+
+def run(number, repeat):
+    print(f"{'scenes':>8}{'size':>10}{'full decode/s':>16}{'header-only/s':>16}{'speedup':>10}")
+
+    for scenes in (5, 20, 100, 500):
+        frame = scene_list_response(scenes, 8)
+        assert {**json.loads(full_decode(frame)), 'error': ''} == {**json.loads(header_only(frame)), 'error': ''}
+        n = max(number // scenes, 10)
+
+        full = min(timeit.repeat(lambda: full_decode(frame), number=n, repeat=repeat))
+        header = min(timeit.repeat(lambda: header_only(frame), number=n, repeat=repeat))
+        print(f"{scenes:>8}{len(frame) // 1024:>8}kB{n / full:>16,.0f}{n / header:>16,.0f}{full / header:>9.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of forwarding large OBS responses through the heart')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='Messages per run for 1 scene')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per response size')
+    args = parser.parse_args()
+
+    run(args.number, args.repeat)
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import websockets
+from heart.server import Server
+from heart.admission import AdmissionControl
+from misc import baseclient, message as msg
+
+HOST = '127.0.0.1'
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+
+    if not latencies:
+        return {}
+
+    def percentile(fraction):
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+
+    return {'min-ms': latencies[0] * 1000, 'p50-ms': percentile(0.5), 'p99-ms': percentile(0.99),
+            'p999-ms': percentile(0.999), 'max-ms': latencies[-1] * 1000}
+
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+class Usage:
+    """
+    Wall time, CPU time and memory of a workload. Heart and clients run in this process, CPU is their sum
+    """
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu = self._cpu()
+
+        return self
+
+    def __exit__(self, *_):
+        self.wall = time.perf_counter() - self.start
+        self.cpu = self._cpu() - self.cpu
+
+    @staticmethod
+    def _cpu():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+
+        return usage.ru_utime + usage.ru_stime
+
+    def result(self, messages):
+        return {'seconds': self.wall, 'throughput': messages / self.wall, 'cpu-seconds': self.cpu,
+                'cpu-percent': 100 * self.cpu / self.wall, 'rss-bytes': rss()}
+
+
+async def start_clients(address, applications, subscribers, payload):
+    apps = []
+
+    for index in range(applications):
+        app = baseclient.Client(f'app{index}', address, f'App{index}')
+
+        async def echo(request, app=app):
+            await app.send(msg.Ok(request.id, payload=request.additionals.get('payload')))
+
+        app.add_request('Echo', echo)
+        apps.append(app)
+
+    subs = []
+
+    for index in range(subscribers):
+        sub = baseclient.Client(f'sub{index}', address, None, [app.registration for app in apps])
+        sub.received = []
+        sub.add_event('Load', lambda event, sub=sub: received(sub, event))
+        subs.append(sub)
+
+    tasks = [asyncio.create_task(client.connect()) for client in apps]
+    await asyncio.gather(*[app.ready.wait() for app in apps])
+    tasks += [asyncio.create_task(client.connect()) for client in subs]
+    await asyncio.gather(*[sub.ready.wait() for sub in subs])
+
+    return apps, subs, tasks
+
+
+async def received(sub, event):
+    sub.received.append(time.perf_counter() - event.additionals['sent'])
+
+
+async def request_workload(apps, subs, number, concurrency, payload):
+    latencies = []
+    errors = 0
+
+    async def worker(sub, requests):
+        nonlocal errors
+
+        for index in requests:
+            app = apps[index % len(apps)]
+            start = time.perf_counter()
+
+            try:
+                await sub.send_wait(msg.Request(app.registration, 'Echo', sub.message_manager.new_id(),
+                                                payload=payload))
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    with Usage() as usage:
+        await asyncio.gather(*[worker(sub, range(worker_index, number, concurrency))
+                               for sub in subs for worker_index in range(concurrency)])
+
+    return {'requests': number * len(subs), 'errors': errors, **usage.result(len(latencies)),
+            **percentiles(latencies)}
+
+
+async def event_workload(apps, subs, number, rate, payload):
+    expected = number * len(apps) * len(subs)
+    interval = len(apps) / rate if rate else 0
+
+    for sub in subs:
+        sub.received.clear()
+
+    async def publisher(app):
+        for _ in range(number):
+            await app.send(msg.Event('Load', sent=time.perf_counter(), payload=payload))
+            await asyncio.sleep(interval)
+
+    with Usage() as usage:
+        await asyncio.gather(*[publisher(app) for app in apps])
+        deadline = time.perf_counter() + 10
+
+        while sum(len(sub.received) for sub in subs) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+    latencies = [latency for sub in subs for latency in sub.received]
+
+    return {'events': number * len(apps), 'expected-deliveries': expected, 'deliveries': len(latencies),
+            **usage.result(len(latencies)), **percentiles(latencies)}
+
+
+async def run(args):
+    admission = None if args.admission else AdmissionControl(0, 0, 0, {})
+    unix_path = os.path.join(tempfile.gettempdir(), f'streamheart-load-{os.getpid()}.sock') \
+        if args.transport == 'unix' else None
+    server = Server(HOST, args.port, response_cache=False, admission=admission, journal=args.journal,
+                    loopback=args.transport == 'loopback', unix_path=unix_path)
+    server_task = asyncio.create_task(server.start())
+
+    while not server.websocket:
+        await asyncio.sleep(0.01)
+
+    payload = 'x' * args.payload
+    address = (f'{baseclient.UNIX_SCHEME}{unix_path}', args.port) if unix_path else (HOST, args.port)
+    apps, subs, tasks = await start_clients(address, args.applications, args.subscribers, payload)
+    result = {
+        'config': {key.replace('_', '-'): value for key, value in vars(args).items() if key != 'output'},
+        'environment': {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+                        'websockets': websockets.__version__, 'codec': subs[0].codec.subprotocol,
+                        'platform': platform.platform()},
+    }
+
+    if args.workload in ('all', 'requests'):
+        await request_workload(apps, subs, max(args.requests // 10, 1), args.concurrency, payload)
+        result['requests'] = await request_workload(apps, subs, args.requests, args.concurrency, payload)
+
+    if args.workload in ('all', 'events'):
+        result['events'] = await event_workload(apps, subs, args.events, args.event_rate, payload)
+
+    result['max-rss-bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    [task.cancel() for task in tasks]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    server.stop_server()
+    await server_task
+
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+
+        return sock.getsockname()[1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the heart with synthetic applications and subscribers '
+                                                 'on localhost. Prints the results as JSON')
+    parser.add_argument('-a', '--applications', type=int, default=2, help='Registered applications')
+    parser.add_argument('-s', '--subscribers', type=int, default=10, help='Subscribers of all applications')
+    parser.add_argument('-w', '--workload', choices=['all', 'requests', 'events'], default='all')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='Requests per subscriber')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='Requests in flight per subscriber')
+    parser.add_argument('-e', '--events', type=int, default=1000, help='Events per application')
+    parser.add_argument('-r', '--event-rate', type=float, default=0,
+                        help='Events per second of all applications. 0 for as fast as possible')
+    parser.add_argument('-p', '--payload', type=int, default=64, help='Payload bytes of requests and events')
+    parser.add_argument('--admission', action='store_true', help='Keep the default admission control limits')
+    parser.add_argument('--journal', help='Record all messages in a journal at this path')
+    parser.add_argument('-t', '--transport', choices=['tcp', 'unix', 'loopback'], default='tcp',
+                        help='Connection of the clients: websocket over TCP or a Unix socket, or in memory like in '
+                             'the embedded mode')
+    parser.add_argument('--port', type=int, default=0, help='Heart port. Default is a free port')
+    parser.add_argument('-o', '--output', help='Write the JSON results to this file')
+    args = parser.parse_args()
+    args.port = args.port if args.port else free_port()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    results = json.dumps(asyncio.run(run(args)), indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results + '\n')
+    else:
+        sys.stdout.write(results + '\n')
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import timeit
+import argparse
+from misc import exceptions, message as msg
+
+MESSAGES = {
+    'Event': str(msg.Event('SwitchScenes', **{'scene-name': 'Live', 'sources': [{'name': 'Cam'}] * 4})),
+    'Request': str(msg.Request('OBS Studio', 'SetCurrentScene', 42, **{'scene-name': 'BRB'})),
+    'Response': str(msg.Ok(42, **{'current-scene': 'Live', 'scenes': [{'name': f'Scene {i}'} for i in range(8)]})),
+}
+
+
+def legacy_check_message(message):
+    """
+    Message check before single-pass decoding. Every check and the chosen constructor decode the frame again
+    """
+    try:
+        try:
+            msg.Event.check(message)
+            return msg.Event(message=message, check=False)
+        except exceptions.InvalidEventError:
+            pass
+        try:
+            msg.Request.check(message)
+            return msg.Request(message=message, check=False)
+        except exceptions.InvalidRequestError:
+            pass
+        try:
+            msg.Response.check(message)
+            return msg.Response(message=message, check=False)
+        except exceptions.InvalidResponseError:
+            pass
+    except exceptions.InvalidMessageError:
+        return None
+
+    return None
+
+
+def run(number, repeat):
+    print(f"{'kind':<10}{'before msg/s':>16}{'after msg/s':>16}{'speedup':>10}")
+
+    for kind, message in MESSAGES.items():
+        before = min(timeit.repeat(lambda: legacy_check_message(message), number=number, repeat=repeat))
+        after = min(timeit.repeat(lambda: msg.check_message(message), number=number, repeat=repeat))
+        print(f"{kind:<10}{number / before:>16,.0f}{number / after:>16,.0f}{before / after:>9.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark of middleware message decoding')
+    parser.add_argument('-n', '--number', type=int, default=50000, help='Messages per run')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per message kind')
+    args = parser.parse_args()
+
+    run(args.number, args.repeat)
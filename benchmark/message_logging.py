@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import io
+import timeit
+import logging
+import argparse
+from misc import message as msg
+from misc.message_log import MessageLog
+
+logger = logging.getLogger('benchmark.message_logging')
+REQUEST = msg.Request('OBS Studio', 'SetCurrentScene', 42, **{'scene-name': 'BRB', 'deadline': 2.0})
+RESPONSE = str(msg.Ok(42, **{'current-scene': 'Live', 'scenes': [{'name': f'Scene {i}'} for i in range(8)]}))
+
+
+def fstring_receive():
+    """
+    Debug log of the heart's consumer before the message log. The message is formatted even if debug is off
+    """
+    logger.debug(f"Message from ClientID {7}: {RESPONSE}")
+
+
+def fstring_send():
+    """
+    Debug log of the client's send before the message log. The request is encoded to JSON for it
+    """
+    logger.debug(f"Message send: {REQUEST}")
+
+
+def message_log_receive(message_log):
+    start = message_log.start()
+
+    if start is not None:
+        message_log.log(start, 'received', client=7, size=len(RESPONSE), forwarded=True, message=RESPONSE)
+
+
+def message_log_send(message_log):
+    start = message_log.start()
+
+    if start is not None:
+        message_log.log(start, 'send', client='obsclient', size=len(RESPONSE), message=REQUEST)
+
+
+def measure(function, number, repeat):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1000000000
+
+
+def run(number, repeat, sample_rate):
+    output = io.StringIO()
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    message_log = MessageLog(logger)
+    sampled_log = MessageLog(logger, sample_rate)
+    cases = [
+        ('none', lambda: None, lambda: None),
+        ('f-string logger.debug', fstring_receive, fstring_send),
+        ('message log', lambda: message_log_receive(message_log), lambda: message_log_send(message_log)),
+        (f'message log, 1/{sample_rate} sampled', lambda: message_log_receive(sampled_log),
+         lambda: message_log_send(sampled_log)),
+    ]
+
+    print(f"{'level':<7}{'logging':<32}{'receive ns':>12}{'send ns':>12}")
+
+    for level in (logging.INFO, logging.DEBUG):
+        logger.setLevel(level)
+
+        for name, receive, send in cases:
+            receive_ns, send_ns = measure(receive, number, repeat), measure(send, number, repeat)
+            print(f"{logging.getLevelName(level):<7}{name:<32}{receive_ns:>12,.0f}{send_ns:>12,.0f}")
+            output.seek(0)
+            output.truncate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per message cost of logging on the hot paths of heart and clients')
+    parser.add_argument('-n', '--number', type=int, default=100000, help='Messages per run')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per case')
+    parser.add_argument('-s', '--sample-rate', type=int, default=100, help='Sample rate of the sampled message log')
+    args = parser.parse_args()
+
+    run(args.number, args.repeat, args.sample_rate)
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from functools import partial
+from heart.server import Server
+from heart.admission import AdmissionControl
+from obs.client import OBSClient, APPLICATION_NAME
+from obs.mock_server import MockOBS
+from heart_rate import heart_rate
+from heart_rate.stream_health import State
+from misc import baseclient, message as msg
+from benchmark.load import HOST, percentiles, free_port
+
+LIVE_SCENE = 'Live'
+BRB_SCENE = 'BRB'
+END_SCENE = 'End'
+BAD_CONNECTION = 'Bad connection'
+
+
+class ScriptedStream:
+    """
+    Stream of Heartrate with health states from the benchmark instead of the RTMP statistics
+    """
+
+    def __init__(self, state=State.STABLE):
+        self.active = asyncio.Event()
+        self.active.set()
+        self.state = state
+        self.states = asyncio.Queue()
+        self.stream = {'bitrate': 0}
+
+    async def check_health(self):
+        self.state = await self.states.get()
+        self.stream['bitrate'] = 0 if self.state in (State.OFFLINE, State.CRITICAL) else 6000000
+
+        return self.state
+
+    def get_health_state(self):
+        return self.state
+
+
+class Expectations:
+    """
+    Futures for requests that reach the mock OBS, resolved with the time they were processed
+    """
+
+    def __init__(self):
+        self.waiting = []
+
+    def expect(self, request_type, **fields):
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.append((request_type, fields, future))
+
+        return future
+
+    def processed(self, request):
+        now = time.perf_counter()
+
+        for expectation in list(self.waiting):
+            request_type, fields, future = expectation
+
+            if request['request-type'] == request_type and all(request.get(key) == value
+                                                               for key, value in fields.items()):
+                self.waiting.remove(expectation)
+                future.set_result(now)
+
+
+async def wait_for_scene(scene, timeout=6):
+    deadline = time.perf_counter() + timeout
+
+    while heart_rate.current_scene != scene and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+
+
+async def bitrate_drop(stream, expectations, number):
+    """
+    Bitrate drops to CRITICAL until OBS switches to BRB, recovers to STABLE until OBS switches back to live.
+    The recovery is complete when OBS hid the bad connection source as well
+    """
+    drops, recoveries, completed = [], [], []
+
+    for _ in range(number):
+        switched = expectations.expect('SetCurrentScene', **{'scene-name': BRB_SCENE})
+        start = time.perf_counter()
+        stream.states.put_nowait(State.CRITICAL)
+        drops.append(await asyncio.wait_for(switched, 6) - start)
+        await wait_for_scene(BRB_SCENE)
+
+        switched = expectations.expect('SetCurrentScene', **{'scene-name': LIVE_SCENE})
+        hidden = expectations.expect('SetSceneItemProperties', item=BAD_CONNECTION, visible=False)
+        start = time.perf_counter()
+        stream.states.put_nowait(State.STABLE)
+        recoveries.append(await asyncio.wait_for(switched, 6) - start)
+        completed.append(await asyncio.wait_for(hidden, 6) - start)
+        await wait_for_scene(LIVE_SCENE)
+
+    return {'drop-to-brb': percentiles(drops), 'recovery-to-live': percentiles(recoveries),
+            'recovery-complete': percentiles(completed)}
+
+
+async def chat_command(client, expectations, number):
+    """
+    Scene switch of a chat command (!live, !end) from the Twitch bot client. The IRC connection isn't included
+    """
+    to_obs, round_trips = [], []
+
+    for index in range(number):
+        scene = END_SCENE if index % 2 else LIVE_SCENE
+        switched = expectations.expect('SetCurrentScene', **{'scene-name': scene})
+        start = time.perf_counter()
+        await client.send_wait(msg.Request(APPLICATION_NAME, 'SetCurrentScene', client.message_manager.new_id(),
+                                           **{'scene-name': scene}))
+        round_trips.append(time.perf_counter() - start)
+        to_obs.append(await switched - start)
+
+    return {'command-to-obs': percentiles(to_obs), 'command-round-trip': percentiles(round_trips)}
+
+
+async def connect(client):
+    task = asyncio.create_task(client.connect())
+    await client.ready.wait()
+
+    return task
+
+
+async def run(args):
+    admission = None if args.admission else AdmissionControl(0, 0, 0, {})
+    server = Server(HOST, args.heart_port, admission=admission)
+    server_task = asyncio.create_task(server.start())
+    obs = MockOBS(HOST, args.obs_port, args.latency / 1000, args.jitter / 1000, args.event_rate)
+    obs.current_scene = LIVE_SCENE
+    obs.streaming, obs.stream_started = True, time.monotonic()
+    expectations = Expectations()
+    obs.on_request = expectations.processed
+    await obs.start()
+
+    while not server.websocket:
+        await asyncio.sleep(0.01)
+
+    tasks = [await connect(OBSClient('obsclient', (HOST, args.heart_port), (HOST, args.obs_port),
+                                     APPLICATION_NAME))]
+
+    heart_rate.live_scene, heart_rate.brb_scene, heart_rate.bad_connection = LIVE_SCENE, BRB_SCENE, BAD_CONNECTION
+    heart_rate.current_scene = LIVE_SCENE
+    stream = ScriptedStream()
+    heartrate = baseclient.Client('heart_rate', (HOST, args.heart_port), heart_rate.APPLICATION_NAME,
+                                  [APPLICATION_NAME])
+    heartrate.add_event('SwitchScenes', partial(heart_rate.event_switch_scenes, client=heartrate, stream=stream))
+    tasks.append(await connect(heartrate))
+    tasks.append(asyncio.create_task(heart_rate.run_check_health(heartrate, stream)))
+
+    twitch_bot = baseclient.Client('twitch_bot', (HOST, args.heart_port), 'TwitchBot', [APPLICATION_NAME])
+    tasks.append(await connect(twitch_bot))
+
+    result = {'config': {key.replace('_', '-'): value for key, value in vars(args).items() if key != 'output'}}
+    result.update(await bitrate_drop(stream, expectations, args.number))
+    result.update(await chat_command(twitch_bot, expectations, args.number))
+    result['obs-requests'] = obs.requests
+
+    [task.cancel() for task in tasks]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    server.stop_server()
+    await server_task
+    await obs.stop()
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end latency from Heartrate and Twitch bot through the heart '
+                                                 'and the OBS bridge to a mock OBS. Prints the results as JSON')
+    parser.add_argument('-n', '--number', type=int, default=100, help='Scene switches per scenario')
+    parser.add_argument('--latency', type=float, default=0, help='Processing time of the mock OBS in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='Random additional processing time in ms')
+    parser.add_argument('--event-rate', type=float, default=0, help='StreamStatus events per second of the mock OBS')
+    parser.add_argument('--admission', action='store_true', help='Keep the default admission control limits')
+    parser.add_argument('--heart-port', type=int, default=0, help='Heart port. Default is a free port')
+    parser.add_argument('--obs-port', type=int, default=0, help='Mock OBS port. Default is a free port')
+    parser.add_argument('-o', '--output', help='Write the JSON results to this file')
+    args = parser.parse_args()
+    args.heart_port = args.heart_port if args.heart_port else free_port()
+    args.obs_port = args.obs_port if args.obs_port else free_port()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    results = json.dumps(asyncio.run(run(args)), indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results + '\n')
+    else:
+        sys.stdout.write(results + '\n')
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import argparse
+import tracemalloc
+from misc import exceptions, message as msg
+from misc.message_manager import MessageManager
+
+
+class TaskMessageManager:
+    """
+    Request tracking before the timer wheel. Every request spawns a timeout task with wait_for and shield
+    """
+    MAX_WAIT_TIME = 6
+
+    def __init__(self):
+        self.request_awaits = {}
+
+    def add_request(self, request):
+        loop = asyncio.get_event_loop()
+        request_future = loop.create_future()
+        loop.create_task(self.request_timeout(request.id, request_future))
+        self.request_awaits[request.id] = request_future
+
+        return request_future
+
+    async def request_timeout(self, request_id, future):
+        try:
+            await asyncio.wait_for(asyncio.shield(future), TaskMessageManager.MAX_WAIT_TIME)
+        except asyncio.TimeoutError:
+            future.set_exception(exceptions.RequestTimeout(request_id))
+        finally:
+            self.request_awaits.pop(request_id, None)
+
+    def response_received(self, response):
+        self.request_awaits[response.id].set_result(response)
+
+
+async def measure(manager_class, outstanding):
+    requests = [msg.Request('OBS Studio', 'GetSceneList', i) for i in range(outstanding)]
+    responses = [msg.Ok(i) for i in range(outstanding)]
+    manager = manager_class()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    futures = [manager.add_request(request) for request in requests]
+    await asyncio.sleep(0)
+    added = time.perf_counter()
+    memory = tracemalloc.get_traced_memory()[0]
+
+    for response in responses:
+        manager.response_received(response)
+    await asyncio.gather(*futures)
+
+    while manager.request_awaits:
+        await asyncio.sleep(0)
+
+    done = time.perf_counter()
+    tracemalloc.stop()
+
+    return outstanding / (done - start), added - start, memory
+
+
+async def run(outstanding, repeat):
+    print(f"{'manager':<22}{'requests/s':>14}{'add ms':>10}{'memory kB':>12}")
+
+    for manager_class in (TaskMessageManager, MessageManager):
+        results = [await measure(manager_class, outstanding) for _ in range(repeat)]
+        rate, add, memory = max(results, key=lambda result: result[0])
+        print(f"{manager_class.__name__:<22}{rate:>14,.0f}{add * 1000:>10.1f}{memory / 1024:>12,.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of request timeout tracking with outstanding requests')
+    parser.add_argument('-n', '--outstanding', type=int, default=10000, help='Outstanding requests')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per manager')
+    args = parser.parse_args()
+
+    asyncio.run(run(args.outstanding, args.repeat))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLIENT_RATE = 'client-rate'
+APPLICATION_RATE = 'application-rate'
+IN_FLIGHT = 'in-flight'
+DEADLINE_EXPIRED = 'deadline-expired'
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and bursts up to burst requests
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+
+        return True
+
+    def retry_after(self):
+        return max(1 - self.tokens, 0) / self.rate
+
+
+class AdmissionControl:
+    """
+    Rejects requests of a client before they are forwarded if the client exceeds its request rate or its maximum
+    of requests in flight, or if the request rate of the target application is exceeded.
+    A rate or maximum of 0 disables the limit
+    """
+    CLIENT_RATE = 20
+    CLIENT_BURST = 40
+    MAX_IN_FLIGHT = 32
+    # application: (requests per second, burst)
+    APPLICATION_LIMITS = {
+        'OBS Studio': (30, 60),
+    }
+
+    def __init__(self, client_rate=CLIENT_RATE, client_burst=CLIENT_BURST, max_in_flight=MAX_IN_FLIGHT,
+                 application_limits=None):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_in_flight = max_in_flight
+        self.application_limits = application_limits if application_limits is not None else \
+            AdmissionControl.APPLICATION_LIMITS
+        self.clients = {}
+        self.applications = {name: TokenBucket(rate, burst) for name, (rate, burst) in
+                             self.application_limits.items() if rate}
+
+    def admit(self, context, application):
+        """
+        None if the request is admitted, otherwise the reason and the seconds until a retry is admitted
+        """
+        if self.max_in_flight and len(context.requested) >= self.max_in_flight:
+            return IN_FLIGHT, None
+
+        if self.client_rate:
+            try:
+                bucket = self.clients[context.clientid]
+            except KeyError:
+                bucket = self.clients[context.clientid] = TokenBucket(self.client_rate, self.client_burst)
+
+            if not bucket.take():
+                return CLIENT_RATE, bucket.retry_after()
+
+        bucket = self.applications.get(application)
+
+        if bucket and not bucket.take():
+            return APPLICATION_RATE, bucket.retry_after()
+
+        return None
+
+    def remove(self, context):
+        self.clients.pop(context.clientid, None)
+
+    def __repr__(self):
+        return f"AdmissionControl(client_rate: {self.client_rate}, client_burst: {self.client_burst}, " \
+               f"max_in_flight: {self.max_in_flight}, application_limits: {self.application_limits})"
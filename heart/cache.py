@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import json
+import asyncio
+import logging
+from misc import message as msg
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Heart-side cache of responses to idempotent requests. Entries are keyed by application, request-type and
+    parameters, expire after a per request-type TTL and are invalidated by related events. Only request-types with a
+    configured TTL are cached
+    """
+    # Entries kept per request-type, the oldest entry is dropped for a new one
+    MAX_ENTRIES = 256
+
+    def __init__(self, ttls=None, invalidations=None, max_entries=MAX_ENTRIES):
+        # (application, request-type): TTL in seconds
+        self.ttls = ttls if ttls else {}
+        # (application, update-type): request-types invalidated by the event
+        self.invalidations = invalidations if invalidations else {}
+        self.max_entries = max_entries
+        self.entries = {}
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    def key(self, request):
+        """
+        Cache key of a request or None if the request-type isn't cacheable
+        """
+        request_type = request.application, request.request_type
+
+        if request_type not in self.ttls:
+            return None
+
+        # Deadline and trace ID differ on every request without changing the response
+        parameters = {key: value for key, value in request.additionals.items()
+                      if key != msg.DEADLINE_FIELD and key != msg.TRACE_FIELD}
+
+        return (*request_type, json.dumps(parameters, sort_keys=True), self.generations.get(request_type, 0))
+
+    def get(self, key):
+        if not key:
+            return None
+
+        try:
+            expires, response = self.entries[key[:2]][key[2]]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if expires < asyncio.get_event_loop().time():
+            self.entries[key[:2]].pop(key[2])
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return response
+
+    def put(self, key, response):
+        if key[3] != self.generations.get(key[:2], 0):
+            logger.debug(f"Response to {key[1]} not cached. Invalidated while in flight")
+            return
+
+        now = asyncio.get_event_loop().time()
+        entries = self.entries.setdefault(key[:2], {})
+        entries.pop(key[2], None)
+
+        # All entries of a request-type have the same TTL, the oldest entry is the first to expire
+        while entries:
+            parameters = next(iter(entries))
+
+            if entries[parameters][0] >= now and len(entries) < self.max_entries:
+                break
+
+            if entries.pop(parameters)[0] >= now:
+                self.evicted += 1
+
+        entries[key[2]] = (now + self.ttls[key[:2]], response)
+
+    def invalidate(self, application, update_type):
+        for request_type in self.invalidations.get((application, update_type), ()):
+            self.generations[(application, request_type)] = self.generations.get((application, request_type), 0) + 1
+            entries = self.entries.pop((application, request_type), None)
+
+            if entries:
+                self.invalidated += len(entries)
+                logger.debug(f"{update_type} invalidated {len(entries)} cached {request_type} responses")
+
+    def invalidate_application(self, application):
+        for request in [request for request in self.entries if request[0] == application]:
+            self.generations[request] = self.generations.get(request, 0) + 1
+            self.invalidated += len(self.entries.pop(request))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'invalidated': self.invalidated, 'evicted': self.evicted,
+                'entries': sum(len(entries) for entries in self.entries.values())}
@@ -1,19 +1,86 @@
 # -*- coding: utf-8 -*-
 
-import asyncio
+import time
 import logging
-from heart.events import EVENTS
-from heart.request_handler import REQUESTS
-from misc import exceptions, message as msg, constants
+from fnmatch import fnmatchcase
+from heart import admission
+from heart.metrics import Metrics
+from heart.outbound import OutboundQueue
+from heart.events import EVENTS, broadcast
+from heart.request_handler import REQUESTS, FOLLOW_UPS
+from misc import exceptions, codec, message as msg, constants
 
 logger = logging.getLogger(__name__)
 
+ROUND_ROBIN = 'round-robin'
+LEAST_OUTSTANDING = 'least-outstanding'
+BALANCING = (ROUND_ROBIN, LEAST_OUTSTANDING)
+
 
 class Application:
-    def __init__(self, name, websocket=None):
+    def __init__(self, name, client=None, shared=False, balancing=ROUND_ROBIN, last_values=None):
         self.name = name
-        self.websocket = websocket
+        self.instances = [client] if client else []
+        self.shared = shared
+        self.balancing = balancing
+        self.next_instance = 0
         self.subscribers = set()
+        self.update_types = {}
+        self.event_subscribers = {}
+        # update-type: state slot, declared by the application on registration. The last event of each slot is
+        # sent to new subscribers
+        self.last_values = dict(last_values) if last_values else {}
+        self.last_events = {}
+
+    def route(self):
+        """
+        Instance for the next request. Shared applications balance requests over all registered instances
+        """
+        if len(self.instances) == 1:
+            return self.instances[0]
+
+        if self.balancing == LEAST_OUTSTANDING:
+            return min(self.instances, key=lambda instance: len(instance.in_flight))
+
+        self.next_instance = (self.next_instance + 1) % len(self.instances)
+
+        return self.instances[self.next_instance]
+
+    def add_subscriber(self, client, update_types=None):
+        self.subscribers.add(client)
+
+        if update_types is not None:
+            self.update_types[client] = tuple(update_types)
+
+        self.event_subscribers.clear()
+
+    def remove_subscriber(self, client):
+        self.subscribers.remove(client)
+        self.update_types.pop(client, None)
+        self.event_subscribers.clear()
+
+    def subscribers_for(self, update_type):
+        """
+        Subscribers of an update-type. Subscribers without update-types receive every event.
+        The result is cached per update-type until the subscribers change
+        """
+        try:
+            return self.event_subscribers[update_type]
+        except KeyError:
+            subscribers = [sub for sub in self.subscribers if self.wants(sub, update_type)]
+            self.event_subscribers[update_type] = subscribers
+
+            return subscribers
+
+    def wants(self, subscriber, update_type):
+        return subscriber not in self.update_types or any(
+            fnmatchcase(update_type, pattern) for pattern in self.update_types[subscriber])
+
+    def keep_last_event(self, event):
+        try:
+            self.last_events[self.last_values[event.update_type]] = event
+        except KeyError:
+            pass
 
     def __hash__(self):
         return hash(self.name)
@@ -22,44 +89,98 @@ class Application:
         return True if self.name == other else False
 
     def __repr__(self):
-        return f"Application(name: {self.name}, websocket_address: " \
-               f"{self.websocket.remote_address}, subscribers: {self.subscribers})"
+        return f"Application(name: {self.name}, websocket_addresses: " \
+               f"{[instance.websocket.remote_address for instance in self.instances]}, " \
+               f"subscribers: {self.subscribers})"
 
 
 class Client:
-    def __init__(self, clientid, message_manager, websocket, applications):
+    def __init__(self, clientid, message_manager, websocket, applications, connections, header_forwarding=True,
+                 outbound=None, cache=None, metrics=None, admission=None, tracer=None, loop_monitor=None):
         self.clientid = clientid
         self.message_manager = message_manager
         self.state = Pending(self)
         self.websocket = websocket
+        self.codec = codec.get_codec(websocket.subprotocol)
         self.registration = None
+        self.in_flight = set()
+        self.requested = set()
+        # Broadcasts of the client waiting for responses
+        self.gathers = set()
         self.subscriptions = {}
         self.all_applications = applications
+        self.all_connections = connections
+        self.header_forwarding = header_forwarding
+        self.outbound = outbound if outbound else OutboundQueue(websocket)
+        self.cache = cache
+        self.metrics = metrics if metrics else Metrics()
+        self.admission = admission
+        self.tracer = tracer
+        self.loop_monitor = loop_monitor
+        self.bytes_in = 0
+        self.last_seen = time.monotonic()
+        self.pinging = False
 
     async def send(self, message):
-        await self.websocket.send(str(message))
+        self.outbound.put(self.codec.encode(message))
 
-    def add_application(self, name):
-        if name in self.all_applications:
-            raise exceptions.RegisterException(f"{name} is already registered")
+    def peek_header(self, message):
+        if not self.header_forwarding or self.codec is not codec.JsonCodec:
+            return None
+
+        return msg.peek_header(message)
+
+    def received(self):
+        """
+        Unix time of the last message from the client
+        """
+        return time.time() - (time.monotonic() - self.last_seen)
+
+    def add_application(self, name, shared=False, balancing=None, last_values=None):
+        balancing = balancing if balancing else ROUND_ROBIN
 
         if self.registration:
             raise exceptions.RegisterException(f"Unregister {self.registration.name} first to register {name}")
 
-        application = Application(name, self.websocket)
+        if balancing not in BALANCING:
+            raise exceptions.RegisterException(f"Invalid balancing {balancing}. Use one of {', '.join(BALANCING)}")
+
+        if last_values is not None and (type(last_values) is not dict or
+                                        not all(type(slot) is str for slot in last_values.values())):
+            raise exceptions.RegisterException("last-values must be an object of update-types and state slots")
+
+        if name in self.all_applications:
+            application = self.all_applications[name]
+
+            if not shared or not application.shared:
+                raise exceptions.RegisterException(f"{name} is already registered")
+
+            application.instances.append(self)
+
+            if last_values:
+                application.last_values.update(last_values)
+        else:
+            application = Application(name, self, shared, balancing, last_values)
+            self.all_applications[application.name] = application
+
         self.registration = application
-        self.all_applications[application.name] = application
         self.update_state()
 
     async def remove_application(self, name):
-        if self.registration.name != name:
+        if not self.registration or self.registration.name != name:
             raise exceptions.UnregisterException(f"You have not {name} registered")
 
+        application = self.registration
+        application.instances.remove(self)
+
+        if application.instances:
+            self.registration = None
+            self.update_state()
+            await handle_instance_removed(self, application)
+            return
+
         if self.registration.subscribers:
-            done, pending = await asyncio.wait(
-                [EVENTS['UnsubscribedFrom'](sub.websocket, name) for sub in self.registration.subscribers])
-            [future.cancel() for future in pending]
-            [future.exception() for future in done]
+            await EVENTS['UnsubscribedFrom'](self.registration.subscribers, name)
 
         subs = list(self.registration.subscribers)
         [sub.remove_subscription(name) for sub in subs]
@@ -68,7 +189,12 @@ class Client:
         self.all_applications.pop(name)
         self.update_state()
 
-    def add_subscription(self, name):
+        if self.cache:
+            self.cache.invalidate_application(name)
+
+        await handle_instance_removed(self, application)
+
+    def add_subscription(self, name, update_types=None):
         try:
             app = self.all_applications[name]
         except KeyError:
@@ -77,7 +203,7 @@ class Client:
         if name in self.subscriptions:
             raise exceptions.SubscribeException(f"{name} is already subscribed")
 
-        app.subscribers.add(self)
+        app.add_subscriber(self, update_types)
         self.subscriptions[name] = app
         self.update_state()
 
@@ -87,7 +213,7 @@ class Client:
         except KeyError:
             raise exceptions.UnsubscribeException(f"{name} is not subscribed")
 
-        app.subscribers.remove(self)
+        app.remove_subscriber(self)
         self.subscriptions.pop(name)
         self.update_state()
 
@@ -117,6 +243,12 @@ class ClientState:
     def __init__(self, context):
         self.context = context
 
+    async def forward(self, message):
+        """
+        Forward a request or response without decoding the payload. Returns False if it must be handled
+        """
+        return False
+
     def __repr__(self):
         return f"{self.__class__.__name__}(context: {self.context.clientid})"
 
@@ -147,6 +279,15 @@ class Subscribed(ClientState):
     Handle messages from a client in subscribed state that are requests
     """
 
+    async def forward(self, message):
+        header = self.context.peek_header(message)
+
+        if header and header.kind is msg.Request and header.application != constants.MIDDLEWARE_APPLICATION_NAME:
+            await handle_request(self.context, header)
+            return True
+
+        return False
+
     async def handle(self, message):
         try:
             request = msg.Request(message=message)
@@ -166,6 +307,15 @@ class Registered(ClientState):
     Handle messages from a client in registered state that are requests to heart, events or responses
     """
 
+    async def forward(self, message):
+        header = self.context.peek_header(message)
+
+        if header and header.kind is msg.Response:
+            await handle_response(self.context, header)
+            return True
+
+        return False
+
     async def handle(self, message):
         checked_msg = msg.check_message(message)
 
@@ -173,7 +323,7 @@ class Registered(ClientState):
             if checked_msg.application == constants.MIDDLEWARE_APPLICATION_NAME:
                 await handle_middleware_request(self.context, checked_msg)
             else:
-                await self.context.websocket.send(str(msg.Error("You have no subscriptions", checked_msg.id)))
+                await self.context.send(msg.Error("You have no subscriptions", checked_msg.id))
         elif type(checked_msg) is msg.Event:
             await handle_event(self.context, checked_msg)
         elif type(checked_msg) is msg.Response:
@@ -189,6 +339,21 @@ class SubscribedAndRegistered(ClientState):
     Handle messages from a client in SubscribedAndRegistered state that are requests, events or responses
     """
 
+    async def forward(self, message):
+        header = self.context.peek_header(message)
+
+        if not header:
+            return False
+
+        if header.kind is msg.Request and header.application != constants.MIDDLEWARE_APPLICATION_NAME:
+            await handle_request(self.context, header)
+            return True
+        elif header.kind is msg.Response:
+            await handle_response(self.context, header)
+            return True
+
+        return False
+
     async def handle(self, message):
         checked_msg = msg.check_message(message)
 
@@ -209,31 +374,106 @@ class SubscribedAndRegistered(ClientState):
 async def handle_middleware_request(context, request):
     try:
         response = await REQUESTS[request.request_type](context, request)
-        await context.send(response)
     except KeyError as error:
         logger.debug(f"{context}: request-type {error} is invalid")
         await context.send(msg.Error(f"request-type {error} is invalid", request.id))
+        return
+
+    # Requests without response are answered later (Broadcast)
+    if response is None:
+        return
+
+    await context.send(response)
+
+    if response.status is msg.Status.OK and request.request_type in FOLLOW_UPS:
+        await FOLLOW_UPS[request.request_type](context, request)
 
 
 async def handle_request(context, request):
     try:
         app = context.subscriptions[request.application]
+        deadline = request.deadline
+
+        if deadline is not None:
+            if type(deadline) not in (int, float):
+                await context.send(msg.Error(f"{msg.DEADLINE_FIELD} must be a number of seconds", request.id))
+                return
+
+            # Time spent in the heart since the message was received is taken off the budget
+            deadline = round(deadline - (time.monotonic() - context.last_seen), 3)
+
+            if deadline <= 0:
+                await reject(context, request, admission.DEADLINE_EXPIRED, None, "Deadline expired")
+                return
+
+            request.deadline = deadline
+
+        cache_key = context.cache.key(request) if context.cache else None
+        response = context.cache.get(cache_key) if cache_key else None
+
+        if response:
+            context.metrics.application(request.application).cache_hits += 1
+            response.id = request.id
+            await context.send(response)
+            # Lazy arguments, the client is only formatted if debug logging is on
+            logger.debug("Request from %s to %s answered from cache", context, request.application)
+            return
+
+        if context.admission:
+            rejection = context.admission.admit(context, request.application)
+
+            if rejection:
+                await reject(context, request, *rejection)
+                return
+
+        context.metrics.application(request.application).requests += 1
+        instance = app.route()
         request.id, original_id = context.message_manager.new_id(), request.id
-        await app.websocket.send(str(request))
-        context.message_manager.add_request_await(context.websocket, original_id, request.id)
+        await instance.send(request)
+        context.message_manager.add_request_await(context, original_id, request.id, instance,
+                                                  request if app.shared else None, cache_key, deadline, request.trace)
+
+        if context.tracer and request.trace:
+            context.tracer.span(request.trace, 'heart-request', context.received(), application=request.application,
+                                **{'request-type': request.request_type, 'message-id': request.id})
 
-        logger.debug(
-            f"Request from {context} forwarded to {request.application}")
+        logger.debug("Request from %s forwarded to %s", context, request.application)
     except KeyError:
         logger.debug(f"{context} didn't subscribe {request.application}")
         await context.send(msg.Error(f"{request.application} is not subscribed", request.id))
 
 
+async def reject(context, request, reason, retry_after, error=None):
+    context.metrics.application(request.application).rejected[reason] += 1
+    logger.debug("Request from %s to %s rejected (%s)", context, request.application, reason)
+
+    additionals = {'reason': reason}
+
+    if retry_after is not None:
+        additionals['retry-after'] = round(retry_after, 3)
+
+    await context.send(msg.Rejected(error if error else f"Too many requests ({reason})", request.id, **additionals))
+
+
 async def handle_event(context, event):
     try:
-        subscribers = context.registration.subscribers
+        if context.cache:
+            context.cache.invalidate(context.registration.name, event.update_type)
+
+        context.registration.keep_last_event(event)
+
+        subscribers = context.registration.subscribers_for(event.update_type)
+        app_metrics = context.metrics.application(context.registration.name)
+        app_metrics.events += 1
+        app_metrics.deliveries += len(subscribers)
+
         if subscribers:
-            await asyncio.wait([ws.send(str(event)) for ws in subscribers])
+            broadcast(subscribers, event)
+
+        if context.tracer and msg.TRACE_FIELD in event.additionals:
+            context.tracer.span(event.additionals[msg.TRACE_FIELD], 'heart-event', context.received(),
+                                application=context.registration.name, subscribers=len(subscribers),
+                                **{'update-type': event.update_type})
     except KeyError:
         logger.debug(f"{context} send event to the not self registered application {event.application}")
         await context.send(msg.Error(f"You have not {event.application} registered"))
@@ -241,9 +481,76 @@ async def handle_event(context, event):
 
 async def handle_response(context, response):
     try:
-        request = context.message_manager.request_awaits[response.id]
-        request[2].set_result(response)
+        request = context.message_manager.response_received(response.id)
+
+        if context.registration:
+            app_metrics = context.metrics.application(context.registration.name)
+            app_metrics.responses += 1
+            app_metrics.latency.observe(time.monotonic() - request[5])
+
+        if request[4] and response.status is msg.Status.OK:
+            context.cache.put(request[4], response)
+
         response.id, manager_id = request[1], response.id
-        await request[0].send(str(response))
+        await request[0].send(response)
+
+        if context.tracer and request[6]:
+            context.tracer.span(request[6], 'heart-response', context.received(), status=response.status,
+                                **{'message-id': manager_id})
     except KeyError:
         logger.debug(f"{response}: Request isn't anymore in request_awaits")
+
+
+async def cancel_requests(context):
+    """
+    Requests in flight of a disconnected requester are dropped at once, nobody reads their responses anymore.
+    The target instance gets a CancelRequest event to stop working on the request
+    """
+    message_manager = context.message_manager
+
+    for gather in list(context.gathers):
+        gather.cancel()
+
+    for manager_id in list(context.requested):
+        try:
+            _, _, target, *_ = message_manager.response_received(manager_id)
+        except KeyError:
+            continue
+
+        if target is not context:
+            await EVENTS['CancelRequest'](target, manager_id)
+            logger.debug(f"Request {manager_id} of {context} cancelled at {target}")
+
+    context.requested.clear()
+
+
+async def handle_instance_removed(context, application):
+    """
+    Requests in flight at a removed instance fail over to another instance of a shared application with the
+    remaining deadline. Without another instance or budget the requester gets an error response immediately
+    """
+    message_manager = context.message_manager
+
+    for manager_id in list(context.in_flight):
+        try:
+            requester, original_id, _, request, cache_key, forwarded, trace = message_manager.request_awaits[manager_id]
+        except KeyError:
+            continue
+
+        now = time.monotonic()
+
+        if request and request.deadline is not None:
+            request.deadline = round(request.deadline - (now - forwarded), 3)
+
+        if application.instances and request and (request.deadline is None or request.deadline > 0):
+            instance = application.route()
+            message_manager.request_awaits[manager_id] = (requester, original_id, instance, request, cache_key, now,
+                                                          trace)
+            instance.in_flight.add(manager_id)
+            await instance.send(request)
+            logger.debug(f"Request {manager_id} failed over to {instance}")
+        else:
+            message_manager.response_received(manager_id)
+            await requester.send(msg.Error(f"{application.name} disconnected", original_id))
+
+    context.in_flight.clear()
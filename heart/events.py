@@ -2,8 +2,24 @@
 
 from misc.message import Event
 
+def broadcast(clients, message, droppable=True):
+    """
+    Queue a message for all clients. It's encoded once per codec and the same frame is queued for every client
+    """
+    frames = {}
 
-async def unsubscribed_from(websocket, name):
-    await websocket.send(str(Event(update_type='UnsubscribedFrom', name=name)))
+    for client in clients:
+        if client.codec not in frames:
+            frames[client.codec] = client.codec.encode(message)
 
-EVENTS = {'UnsubscribedFrom': unsubscribed_from}
+        client.outbound.put(frames[client.codec], droppable)
+
+
+async def unsubscribed_from(clients, name):
+    broadcast(clients, Event(update_type='UnsubscribedFrom', name=name), droppable=False)
+
+
+async def cancel_request(client, request_id):
+    broadcast((client,), Event(update_type='CancelRequest', **{'request-id': request_id}), droppable=False)
+
+EVENTS = {'UnsubscribedFrom': unsubscribed_from, 'CancelRequest': cancel_request}
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import logging
+from heart.events import EVENTS
+from misc import message as msg
+
+logger = logging.getLogger(__name__)
+
+
+class Gather:
+    """
+    Requester of a broadcast in place of the client. The request is forwarded to every application in parallel,
+    their responses are collected and the client gets one response with all results once every application
+    answered or the deadline expired
+    """
+    # Seconds of the deadline kept to deliver the aggregated response in time
+    MARGIN = 0.05
+
+    def __init__(self, context, request_id, deadline):
+        self.context = context
+        self.request_id = request_id
+        self.deadline = deadline
+        self.started = time.monotonic()
+        # The forwarded requests count as requests of the client. They take part in its in-flight limit and are
+        # cancelled with the other requests of the client when it disconnects
+        self.requested = context.requested
+        # Manager message-id: application
+        self.applications = {}
+        self.results = {}
+        self.answered = 0
+        self.task = None
+        self.done = False
+
+    async def fan_out(self, request_type, additionals, names, trace=None):
+        context = self.context
+
+        for name in names:
+            app = context.all_applications.get(name)
+
+            if not app or not app.instances:
+                self.results[name] = result(msg.Error(f"{name} is not registered"))
+                continue
+
+            if context.admission:
+                rejection = context.admission.admit(context, name)
+
+                if rejection:
+                    reason, retry_after = rejection
+                    context.metrics.application(name).rejected[reason] += 1
+                    retry = {'retry-after': round(retry_after, 3)} if retry_after is not None else {}
+                    self.results[name] = result(msg.Rejected(f"Too many requests ({reason})", None, reason=reason,
+                                                             **retry))
+                    continue
+
+            instance = app.route()
+            manager_id = context.message_manager.new_id()
+            request = msg.Request(name, request_type, manager_id, **additionals)
+            request.deadline = self.deadline
+
+            if trace is not None:
+                request.trace = trace
+
+            context.metrics.application(name).requests += 1
+            self.applications[manager_id] = name
+            await instance.send(request)
+            context.message_manager.add_request_await(self, manager_id, manager_id, instance,
+                                                      request if app.shared else None, None, self.deadline, trace)
+
+        logger.debug(f"Broadcast {request_type} from {self.context} forwarded to {len(self.applications)} "
+                     f"applications")
+
+        if self.applications:
+            self.task = asyncio.create_task(self._expire())
+            context.gathers.add(self)
+        else:
+            await self.finish()
+
+    async def send(self, response):
+        """
+        Response of an application, forwarded by the heart as to a requester
+        """
+        name = self.applications.get(response.id)
+
+        if self.done or name is None or name in self.results:
+            return
+
+        self.results[name] = result(response)
+        self.answered += 1
+
+        if self.answered == len(self.applications):
+            if self.task:
+                self.task.cancel()
+
+            await self.finish()
+
+    async def _expire(self):
+        await asyncio.sleep(self.deadline)
+        await self.finish()
+
+    async def finish(self):
+        if self.done:
+            return
+
+        self.done = True
+        self.context.gathers.discard(self)
+        timeouts = []
+
+        for manager_id, name in self.applications.items():
+            if name in self.results:
+                continue
+
+            timeouts.append(name)
+
+            try:
+                _, _, target, *_ = self.context.message_manager.response_received(manager_id)
+            except KeyError:
+                # Already expired in the message manager
+                continue
+
+            self.context.metrics.application(name).timeouts += 1
+            await EVENTS['CancelRequest'](target, manager_id)
+
+        await self.context.send(msg.Ok(self.request_id, results=self.results, timeouts=timeouts,
+                                       duration=round(time.monotonic() - self.started, 3)))
+        logger.debug(f"Broadcast of {self.context} answered. {len(self.results)} results, {len(timeouts)} timeouts")
+
+    def cancel(self):
+        """
+        The client disconnected, nobody reads the result anymore. Its forwarded requests are cancelled with the other
+        requests of the client
+        """
+        self.done = True
+        self.context.gathers.discard(self)
+
+        if self.task:
+            self.task.cancel()
+
+    def __repr__(self):
+        return f"Gather(context: {self.context.clientid}, request-id: {self.request_id}, " \
+               f"applications: {list(self.applications.values())}, results: {list(self.results)})"
+
+
+def result(response):
+    """
+    Response of an application without its message-id
+    """
+    response = response.as_dict()
+    response.pop(msg.RESPONSE_FIELDS[0], None)
+
+    return response
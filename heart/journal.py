@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import json
+import time
+import struct
+import logging
+import collections
+from misc import codec
+
+logger = logging.getLogger(__name__)
+
+# Magic, version, capacity, head, tail, records in the ring, records written
+HEADER = struct.Struct('<8sIQQQQQ')
+# Record length, timestamp, client id, application length, binary frame
+RECORD = struct.Struct('<IdIBB')
+LENGTH = struct.Struct('<I')
+MAGIC = b'SHJRNL01'
+VERSION = 1
+WRAP = 0
+
+Record = collections.namedtuple('Record', ['timestamp', 'clientid', 'application', 'frame'])
+
+
+class Journal:
+    """
+    Fixed-size ring buffer in a memory-mapped file. Every frame received by the heart is appended as compact
+    record with timestamp, client id and the registered application of the sender. The oldest records are
+    overwritten if the ring is full
+    """
+    SIZE = 64 * 1024 * 1024
+
+    def __init__(self, path, size=SIZE):
+        self.path = path
+        self.size = max(size, HEADER.size + RECORD.size + 1024)
+        self.file = None
+        self.map = None
+        self.capacity = self.size - HEADER.size
+        self.head = HEADER.size
+        self.tail = HEADER.size
+        self.count = 0
+        self.written = 0
+        self.too_large = 0
+        self.names = {}
+
+    def open(self):
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) == self.size
+        self.file = open(self.path, 'r+b' if exists else 'w+b')
+
+        if not exists:
+            self.file.truncate(self.size)
+
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        magic, version, capacity, head, tail, count, written = HEADER.unpack_from(self.map, 0)
+
+        if magic == MAGIC and version == VERSION and capacity == self.capacity:
+            # Continue the journal of the last run
+            self.head, self.tail, self.count, self.written = head, tail, count, written
+        else:
+            self._write_header()
+
+        logger.debug(f"Journal opened ({self.path}, {self.count} records)")
+
+    def close(self):
+        if self.map:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+    def append(self, clientid, application, frame):
+        if isinstance(frame, dict):
+            # Loopback connections pass messages as dicts, they are recorded as JSON
+            frame = json.dumps(frame)
+
+        binary = not isinstance(frame, str)
+
+        if not binary:
+            frame = frame.encode()
+
+        try:
+            name = self.names[application]
+        except KeyError:
+            name = self.names[application] = application.encode()[:255] if application else b''
+
+        length = RECORD.size + len(name) + len(frame)
+
+        if length > self.capacity // 2:
+            self.too_large += 1
+            return
+
+        end = self.size
+
+        if self.head + length > end:
+            # Records behind the head are lost, the record is written to the start of the ring
+            while self.count and self.tail >= self.head:
+                self._evict()
+
+            if self.head + LENGTH.size <= end:
+                LENGTH.pack_into(self.map, self.head, WRAP)
+
+            self.head = HEADER.size
+
+        while self.count and self.head <= self.tail < self.head + length:
+            self._evict()
+
+        position = self.head
+
+        if not self.count:
+            self.tail = position
+
+        RECORD.pack_into(self.map, position, length, time.time(), clientid, len(name), binary)
+        position += RECORD.size
+        self.map[position:position + len(name)] = name
+        position += len(name)
+        self.map[position:position + len(frame)] = frame
+
+        self.head += length
+        self.count += 1
+        self.written += 1
+        self._write_header()
+
+    def _evict(self):
+        self.tail += LENGTH.unpack_from(self.map, self.tail)[0]
+        self.count -= 1
+
+        if not self.count:
+            self.tail = self.head
+        elif self.tail + LENGTH.size > self.size or not LENGTH.unpack_from(self.map, self.tail)[0]:
+            self.tail = HEADER.size
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, self.head, self.tail, self.count,
+                         self.written)
+
+    def stats(self):
+        return {'records': self.count, 'written': self.written, 'too-large': self.too_large,
+                'used': (self.head - self.tail) % self.capacity if self.count else 0, 'capacity': self.capacity}
+
+
+class JournalReader:
+    """
+    Reads the records of a journal file, oldest first. The journal may be written by a running heart
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = file.read()
+
+        magic, version, capacity, self.head, self.tail, self.count, self.written = HEADER.unpack_from(self.data, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a journal file")
+
+    def __iter__(self):
+        position = self.tail
+        data = self.data
+
+        for _ in range(self.count):
+            if position + LENGTH.size > len(data) or not LENGTH.unpack_from(data, position)[0]:
+                position = HEADER.size
+
+            length, timestamp, clientid, name_length, binary = RECORD.unpack_from(data, position)
+            start = position + RECORD.size
+            application = data[start:start + name_length].decode()
+            frame = data[start + name_length:position + length]
+            position += length
+
+            yield Record(timestamp, clientid, application or None, frame if binary else frame.decode())
+
+    def records(self, start=None, end=None, application=None):
+        for record in self:
+            if start is not None and record.timestamp < start:
+                continue
+            if end is not None and record.timestamp > end:
+                continue
+            if application and record.application != application and target(record) != application:
+                continue
+
+            yield record
+
+
+def decode(record):
+    try:
+        if isinstance(record.frame, str):
+            return json.loads(record.frame)
+
+        return codec.MsgpackCodec.decode(record.frame)
+    except (ValueError, AttributeError):
+        return None
+
+
+def target(record):
+    message = decode(record)
+
+    return message.get('application') if isinstance(message, dict) else None
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import logging
+import websockets
+
+logger = logging.getLogger(__name__)
+
+
+class Liveness:
+    """
+    Heartbeat of all heart connections in one task. A client without any message for an interval is pinged,
+    a client without message or pong for interval + timeout is reaped. Reaping fails the connection at once,
+    its registration is released and its requests in flight fail immediately
+    """
+    INTERVAL = 5
+    TIMEOUT = 5
+
+    def __init__(self, connections, interval=INTERVAL, timeout=TIMEOUT):
+        self.connections = connections
+        self.interval = interval
+        self.timeout = timeout
+        self.task = None
+        self.reaped = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def _run(self):
+        check = min(self.interval, self.timeout) / 2
+
+        while True:
+            await asyncio.sleep(check)
+            now = time.monotonic()
+
+            for context in list(self.connections):
+                idle = now - context.last_seen
+
+                if idle >= self.interval + self.timeout:
+                    self.reap(context, idle)
+                elif idle >= self.interval and not context.pinging:
+                    context.pinging = True
+                    asyncio.create_task(self._ping(context))
+
+    @staticmethod
+    async def _ping(context):
+        try:
+            await (await context.websocket.ping())
+            context.last_seen = time.monotonic()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            context.pinging = False
+
+    def reap(self, context, idle):
+        logger.debug(f"{context} reaped. No heartbeat for {idle:.1f}s")
+        self.reaped += 1
+        # A dead peer doesn't complete a closing handshake, the connection is aborted without waiting for it
+        context.websocket.transport.abort()
+
+    def __repr__(self):
+        return f"Liveness(interval: {self.interval}, timeout: {self.timeout}, reaped: {self.reaped})"
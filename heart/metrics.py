@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import time
+import collections
+
+
+class Histogram:
+    # Upper bounds in seconds, the last bucket is the request timeout
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 6)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            yield bucket, total
+
+
+class ApplicationMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.rejected = collections.Counter()
+        self.responses = 0
+        self.timeouts = 0
+        self.events = 0
+        self.deliveries = 0
+        self.latency = Histogram()
+
+
+class Metrics:
+    """
+    Counters of the heart per application and connection.
+    Exported by the GetStats request and as Prometheus text on the metrics path of the heart
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.applications = {}
+
+    def application(self, name):
+        try:
+            return self.applications[name]
+        except KeyError:
+            self.applications[name] = ApplicationMetrics()
+            return self.applications[name]
+
+    @staticmethod
+    def in_flight(applications, name):
+        try:
+            return sum(len(instance.in_flight) for instance in applications[name].instances)
+        except KeyError:
+            return 0
+
+    @staticmethod
+    def connection(client):
+        return {'client-id': client.clientid,
+                'application': client.registration.name if client.registration else None,
+                'bytes-in': client.bytes_in, 'idle': time.monotonic() - client.last_seen, **client.outbound.stats()}
+
+    def stats(self, applications, connections):
+        uptime = time.monotonic() - self.started
+
+        return {
+            'uptime': uptime,
+            'applications': {name: {
+                'requests': app.requests, 'request-rate': app.requests / uptime, 'cache-hits': app.cache_hits,
+                'rejected': dict(app.rejected), 'in-flight': self.in_flight(applications, name),
+                'responses': app.responses, 'timeouts': app.timeouts, 'events': app.events,
+                'event-rate': app.events / uptime, 'deliveries': app.deliveries,
+                'latency': {'count': app.latency.count, 'sum': app.latency.sum,
+                            'buckets': {str(bucket): count for bucket, count in app.latency.cumulative()}}}
+                for name, app in self.applications.items()},
+            'connections': [self.connection(client) for client in connections]}
+
+    def prometheus(self, applications, connections, cache=None, loop_monitor=None):
+        lines = []
+
+        def metric(name, metric_type, description, samples):
+            lines.append(f"# HELP streamheart_{name} {description}")
+            lines.append(f"# TYPE streamheart_{name} {metric_type}")
+            lines.extend(f"streamheart_{name}{labels(sample_labels)} {value}" for sample_labels, value in samples)
+
+        apps = sorted(self.applications.items())
+        metric('requests_total', 'counter', 'Requests to an application',
+               [({'application': name}, app.requests) for name, app in apps])
+        metric('cache_hits_total', 'counter', 'Requests to an application answered from the response cache',
+               [({'application': name}, app.cache_hits) for name, app in apps])
+        metric('rejected_total', 'counter', 'Requests to an application rejected by the admission control',
+               [({'application': name, 'reason': reason}, count) for name, app in apps
+                for reason, count in sorted(app.rejected.items())])
+        metric('in_flight', 'gauge', 'Forwarded requests waiting for a response',
+               [({'application': name}, self.in_flight(applications, name)) for name, app in apps])
+        metric('timeouts_total', 'counter', 'Forwarded requests without response within the timeout',
+               [({'application': name}, app.timeouts) for name, app in apps])
+        metric('events_total', 'counter', 'Events sent by an application',
+               [({'application': name}, app.events) for name, app in apps])
+        metric('event_deliveries_total', 'counter', 'Events queued for subscribers',
+               [({'application': name}, app.deliveries) for name, app in apps])
+
+        latency = []
+
+        for name, app in apps:
+            latency.extend(({'application': name, 'le': str(bucket)}, count) for bucket, count in
+                           app.latency.cumulative())
+            latency.append(({'application': name, 'le': '+Inf'}, app.latency.count))
+
+        metric('response_latency_seconds', 'histogram', 'Time from forwarding a request to its response', [])
+        lines.extend(f"streamheart_response_latency_seconds_bucket{labels(sample_labels)} {value}"
+                     for sample_labels, value in latency)
+
+        for name, app in apps:
+            app_labels = labels({'application': name})
+            lines.append(f"streamheart_response_latency_seconds_sum{app_labels} {app.latency.sum}")
+            lines.append(f"streamheart_response_latency_seconds_count{app_labels} {app.latency.count}")
+
+        clients = [({'client': str(client.clientid),
+                     'application': client.registration.name if client.registration else ''}, client)
+                   for client in connections]
+        metric('outbound_queue_depth', 'gauge', 'Messages queued for a connection',
+               [(client_labels, client.outbound.depth) for client_labels, client in clients])
+        metric('outbound_dropped_total', 'counter', 'Events dropped for a slow connection',
+               [(client_labels, client.outbound.dropped) for client_labels, client in clients])
+        metric('received_bytes_total', 'counter', 'Message bytes received from a connection',
+               [(client_labels, client.bytes_in) for client_labels, client in clients])
+        metric('sent_bytes_total', 'counter', 'Message bytes sent to a connection',
+               [(client_labels, client.outbound.bytes_out) for client_labels, client in clients])
+
+        if cache:
+            cache_stats = cache.stats()
+            metric('cache_misses_total', 'counter', 'Cacheable requests forwarded to the application',
+                   [({}, cache_stats['misses'])])
+            metric('cache_entries', 'gauge', 'Cached responses', [({}, cache_stats['entries'])])
+
+        if loop_monitor:
+            lag = loop_monitor.lag()
+            handlers = [({'handler': name}, handler) for name, handler in sorted(loop_monitor.handlers.items())]
+            metric('loop_lag_seconds', 'gauge', 'Delay of the last event loop lag sample', [({}, lag['last'])])
+            metric('loop_lag_max_seconds', 'gauge', 'Largest event loop lag since start', [({}, lag['max'])])
+            metric('loop_stalls_total', 'counter', 'Event loop lag samples over the slow handler threshold',
+                   [({}, loop_monitor.stalls)])
+            metric('handler_calls_total', 'counter', 'Handled messages',
+                   [(handler_labels, handler.calls) for handler_labels, handler in handlers])
+            metric('handler_busy_seconds_total', 'counter', 'Time handlers ran on the event loop',
+                   [(handler_labels, handler.busy) for handler_labels, handler in handlers])
+            metric('handler_slow_total', 'counter', 'Handlers that blocked the event loop over the threshold',
+                   [(handler_labels, handler.slow) for handler_labels, handler in handlers])
+
+        return '\n'.join(lines) + '\n'
+
+
+def labels(sample_labels):
+    if not sample_labels:
+        return ''
+
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in sample_labels.items()) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
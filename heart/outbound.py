@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import collections
+import websockets
+from misc import codec
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+    """
+    Bounded queue with its own writer task for every heart connection. A slow client only delays itself.
+    Events are droppable, the oldest queued event is dropped if the queue is full. Requests and responses are
+    never dropped. The connection is closed if the client doesn't keep up within the overflow limit
+    """
+    MAX_SIZE = 256
+    OVERFLOW_LIMIT = 1024
+    CLOSE_CODE = 1008
+    # Internal error, the writer failed unexpectedly
+    ERROR_CODE = 1011
+
+    def __init__(self, websocket, max_size=MAX_SIZE, overflow_limit=OVERFLOW_LIMIT):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.overflow_limit = overflow_limit
+        self.frames = collections.deque()
+        self.events = 0
+        self.ready = asyncio.Event()
+        self.writer = None
+        self.closed = False
+        self.sent = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.overflow = 0
+
+    @property
+    def depth(self):
+        return len(self.frames)
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write())
+
+    def stop(self):
+        self.closed = True
+
+        if self.writer:
+            self.writer.cancel()
+
+        self.frames.clear()
+        self.events = 0
+
+    def put(self, frame, droppable=False):
+        if self.closed:
+            return
+
+        if droppable and self.events >= self.max_size:
+            self._drop_oldest_event()
+        elif len(self.frames) >= self.max_size + self.overflow_limit:
+            self.overflow = self.overflow_limit
+
+        if self.overflow >= self.overflow_limit:
+            self._disconnect()
+            return
+
+        self.frames.append((frame, droppable))
+        self.events += droppable
+        self.ready.set()
+
+    def _drop_oldest_event(self):
+        for index, (_, droppable) in enumerate(self.frames):
+            if droppable:
+                del self.frames[index]
+                self.events -= 1
+                self.dropped += 1
+                self.overflow += 1
+                return
+
+    def _disconnect(self):
+        logger.debug(f"Outbound queue overflow ({self.websocket.remote_address}). Closing connection")
+        self.stop()
+        asyncio.create_task(self.websocket.close(OutboundQueue.CLOSE_CODE, "Outbound queue overflow"))
+
+    async def _write(self):
+        try:
+            while True:
+                if not self.frames:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+
+                frame, droppable = self.frames.popleft()
+                self.events -= droppable
+                await self.websocket.send(frame)
+                self.sent += 1
+                self.bytes_out += codec.frame_size(frame)
+                self.overflow = 0
+        except websockets.ConnectionClosed:
+            logger.debug(f"Outbound queue stopped. Connection closed ({self.websocket.remote_address})")
+            self.closed = True
+        except Exception as error:
+            logger.exception(f"Outbound queue of {self.websocket.remote_address} failed: {error}. Closing connection")
+            self.closed = True
+            self.frames.clear()
+            self.events = 0
+            asyncio.create_task(self.websocket.close(OutboundQueue.ERROR_CODE, "Internal error"))
+
+    def stats(self):
+        return {'depth': self.depth, 'sent': self.sent, 'dropped': self.dropped, 'bytes-out': self.bytes_out}
+
+    def __repr__(self):
+        return f"OutboundQueue(depth: {self.depth}, sent: {self.sent}, dropped: {self.dropped})"
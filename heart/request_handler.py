@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import time
 import logging
+from heart import admission
+from heart.gather import Gather
 from misc import exceptions, message as msg
 
 logger = logging.getLogger(__name__)
@@ -11,7 +14,9 @@ async def register(context, request):
 
     try:
         name = request.additionals['name']
-        context.add_application(name)
+        shared = request.additionals.get('shared', False) is True
+        context.add_application(name, shared, request.additionals.get('balancing'),
+                                request.additionals.get('last-values'))
         response = msg.Ok(request.id)
         logger.debug(f"{name} registered successfully from {context}")
     except KeyError as error:
@@ -47,7 +52,13 @@ async def subscribe(context, request):
 
     try:
         name = request.additionals['name']
-        context.add_subscription(name)
+        update_types = request.additionals.get('update-types')
+
+        if update_types is not None and (type(update_types) is not list or
+                                         not all(type(update_type) is str for update_type in update_types)):
+            raise exceptions.SubscribeException("update-types must be a list of strings")
+
+        context.add_subscription(name, update_types)
         response = msg.Ok(request.id)
         logger.debug(f"{name} subscribed successfully from {context}")
     except KeyError as error:
@@ -78,4 +89,92 @@ async def unsubscribe(context, request):
         return response
 
 
-REQUESTS = {'Register': register, 'Unregister': unregister, 'Subscribe': subscribe, 'Unsubscribe': unsubscribe}
+async def get_queue_stats(context, request):
+    connections = [{'client-id': client.clientid,
+                    'application': client.registration.name if client.registration else None,
+                    **client.outbound.stats()} for client in context.all_connections]
+
+    return msg.Ok(request.id, connections=connections)
+
+
+async def get_cache_stats(context, request):
+    if not context.cache:
+        return msg.Error("Response cache is disabled", request.id)
+
+    return msg.Ok(request.id, **context.cache.stats())
+
+
+async def get_stats(context, request):
+    stats = context.metrics.stats(context.all_applications, context.all_connections)
+
+    if context.cache:
+        stats['cache'] = context.cache.stats()
+
+    if context.loop_monitor:
+        stats['loop'] = context.loop_monitor.stats()
+
+    return msg.Ok(request.id, **stats)
+
+
+async def get_loop_stats(context, request):
+    if not context.loop_monitor:
+        return msg.Error("Loop monitor is disabled", request.id)
+
+    return msg.Ok(request.id, **context.loop_monitor.stats())
+
+
+async def broadcast(context, request):
+    """
+    Forward a request to several or all registered applications. The gather answers the request once every
+    application responded or the deadline expired
+    """
+    try:
+        broadcast_request = dict(request.additionals['request'])
+        request_type = broadcast_request.pop(msg.REQUEST_FIELDS[1])
+        names = request.additionals.get('applications')
+
+        if names is None:
+            names = list(context.all_applications)
+        elif type(names) is not list or not all(type(name) is str for name in names):
+            return msg.Error("applications must be a list of strings", request.id)
+    except KeyError as error:
+        logger.debug(f"Missing field {error}")
+        return msg.Error(f"Missing field: {error}", request.id)
+    except (TypeError, ValueError):
+        return msg.Error("request must be an object with request-type", request.id)
+
+    for field in (msg.REQUEST_FIELDS[0], msg.REQUEST_FIELDS[2], msg.DEADLINE_FIELD, msg.TRACE_FIELD):
+        broadcast_request.pop(field, None)
+
+    deadline = request.deadline
+
+    if deadline is not None and type(deadline) not in (int, float):
+        return msg.Error(f"{msg.DEADLINE_FIELD} must be a number of seconds", request.id)
+
+    max_wait = context.message_manager.MAX_WAIT_TIME
+    deadline = min(deadline, max_wait) if deadline is not None else max_wait
+    # Time spent in the heart since the message was received is taken off the budget
+    deadline = round(deadline - (time.monotonic() - context.last_seen) - Gather.MARGIN, 3)
+
+    if deadline <= 0:
+        return msg.Rejected("Deadline expired", request.id, reason=admission.DEADLINE_EXPIRED)
+
+    gather = Gather(context, request.id, deadline)
+    await gather.fan_out(request_type, broadcast_request, dict.fromkeys(names), request.trace)
+
+
+async def replay_last_events(context, request):
+    app = context.subscriptions[request.additionals['name']]
+
+    for event in list(app.last_events.values()):
+        if app.wants(context, event.update_type):
+            # Marked as replay, the subscriber can take over the state without acting on it like on a change
+            await context.send(msg.Event(event.update_type, **{**event.additionals, msg.REPLAY_FIELD: True}))
+
+
+REQUESTS = {'Register': register, 'Unregister': unregister, 'Subscribe': subscribe, 'Unsubscribe': unsubscribe,
+            'GetQueueStats': get_queue_stats, 'GetCacheStats': get_cache_stats, 'GetStats': get_stats,
+            'GetLoopStats': get_loop_stats, 'Broadcast': broadcast}
+
+# Called after a successful response to the request
+FOLLOW_UPS = {'Subscribe': replay_last_events}
@@ -1,50 +1,87 @@
 # -*- coding: utf-8 -*-
 
+import os
 import ssl
+import stat
+import time
 import signal
 import asyncio
 import logging
 import pathlib
 import websockets
 from heart import client
+from heart.cache import ResponseCache
+from heart.metrics import Metrics
+from heart.journal import Journal
+from heart.admission import AdmissionControl
+from heart.liveness import Liveness
+from http import HTTPStatus
+from heart.outbound import OutboundQueue
+from misc import exceptions, codec, message as msg
+from misc.message_log import MessageLog
+from misc.loop_monitor import LoopMonitor
+from misc import tracing, loopback
+from misc.timer_wheel import TimerWheel
 
 logger = logging.getLogger(__name__)
 DEFAULTPORT = 4445
+METRICS_PATH = '/metrics'
 
 
 class ServerMessageManager:
     # TODO Remove ServerMessageManager. Ideally only one MessageManager class for Server and Clients
     MAX_WAIT_TIME = 6
 
-    def __init__(self):
+    def __init__(self, metrics=None):
         self.id = 0
         self.request_awaits = {}
+        self.timeouts = TimerWheel(self.requests_timeout)
+        self.metrics = metrics if metrics else Metrics()
 
     def new_id(self):
         self.id, old_id = self.id + 1, self.id
 
         return old_id
 
-    def add_request_await(self, client_websocket, original_messageid, new_messageid):
-        loop = asyncio.get_event_loop()
-        request_future = loop.create_future()
-        loop.create_task(self.request_timeout(new_messageid, request_future))
-        self.request_awaits[new_messageid] = (client_websocket, original_messageid, request_future)
+    def add_request_await(self, client_context, original_messageid, new_messageid, target_context, request=None,
+                          cache_key=None, deadline=None, trace=None):
+        self.request_awaits[new_messageid] = (client_context, original_messageid, target_context, request, cache_key,
+                                              time.monotonic(), trace)
+        self.timeouts.add(new_messageid, min(deadline, ServerMessageManager.MAX_WAIT_TIME) if deadline else
+                          ServerMessageManager.MAX_WAIT_TIME)
+        client_context.requested.add(new_messageid)
+        target_context.in_flight.add(new_messageid)
+
+    def response_received(self, messageid):
+        request = self.request_awaits.pop(messageid)
+        self.timeouts.remove(messageid)
+        request[0].requested.discard(messageid)
+        request[2].in_flight.discard(messageid)
+
+        return request
+
+    def requests_timeout(self, messageids):
+        for messageid in messageids:
+            request = self.request_awaits.pop(messageid, None)
+
+            if request:
+                request[0].requested.discard(messageid)
+                request[2].in_flight.discard(messageid)
+
+                if request[2].registration:
+                    self.metrics.application(request[2].registration.name).timeouts += 1
 
-    async def request_timeout(self, messageid, future):
-        try:
-            await asyncio.wait_for(future, ServerMessageManager.MAX_WAIT_TIME)
-        except asyncio.TimeoutError:
             logger.debug(f"Awaited request timeout (message-id: {messageid})")
-        finally:
-            try:
-                self.request_awaits.pop(messageid)
-            except KeyError:
-                logger.debug(f"Timeouted request isn't in request_awaits anymore (message-id: {messageid})")
 
 
 class Server:
-    def __init__(self, host=None, port=DEFAULTPORT, ssl_cert=None):
+    def __init__(self, host=None, port=DEFAULTPORT, ssl_cert=None, header_forwarding=True,
+                 queue_size=OutboundQueue.MAX_SIZE, overflow_limit=OutboundQueue.OVERFLOW_LIMIT, response_cache=True,
+                 cache_ttls=None, cache_invalidations=None, cache_size=ResponseCache.MAX_ENTRIES, metrics_path=None,
+                 journal=None, journal_size=Journal.SIZE,
+                 admission=None, heartbeat_interval=Liveness.INTERVAL, heartbeat_timeout=Liveness.TIMEOUT,
+                 trace_sample=MessageLog.SAMPLE_RATE, trace_export=None, loopback=False, unix_path=None,
+                 lag_interval=LoopMonitor.INTERVAL, slow_handler=LoopMonitor.THRESHOLD):
         self.websocket = None
         self.host = host
         self.port = port
@@ -54,8 +91,28 @@ class Server:
         self.loop = None
         self.stop = None
         self.clientid = 0
-        self.message_manager = ServerMessageManager()
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+        self.message_manager = ServerMessageManager(self.metrics)
         self.ssl_cert = ssl_cert
+        self.header_forwarding = header_forwarding
+        self.queue_size = queue_size
+        self.overflow_limit = overflow_limit
+        self.cache = ResponseCache(cache_ttls, cache_invalidations, cache_size) if response_cache else None
+        self.journal = Journal(journal, journal_size) if journal else None
+        self.admission = admission if admission else AdmissionControl()
+        self.liveness = None
+        self.message_log = MessageLog(logger, trace_sample)
+        self.tracer = tracing.tracer('heart', trace_export)
+        # Clients in this process connect without websocket and serialization
+        self.loopback = loopback
+        # Apps on this host connect to the Unix socket without TCP and TLS
+        self.unix_path = unix_path
+        self.unix_server = None
+        self.loop_monitor = LoopMonitor(lag_interval, slow_handler) if lag_interval else None
+
+        if heartbeat_interval:
+            self.liveness = Liveness(self.connections, heartbeat_interval, heartbeat_timeout)
 
         if ssl_cert and len(ssl_cert) > 1 and ssl_cert[0] and ssl_cert[1]:
             self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
@@ -70,22 +127,90 @@ class Server:
         self.loop.add_signal_handler(signal.SIGTERM, self.stop_server)
         self.loop.add_signal_handler(signal.SIGINT, self.stop_server)
 
+        if self.journal:
+            self.journal.open()
+
+        if self.liveness:
+            self.liveness.start()
+
+        if self.loop_monitor:
+            self.loop_monitor.start()
+
+        if self.loopback:
+            loopback.listen(self.port, self._handler)
+
+        # The heartbeat replaces the keepalive pings of websockets (default 20s) for each connection
+        ping_interval = None if self.liveness else 20
+
+        if self.unix_path:
+            self._remove_socket()
+            self.unix_server = await websockets.unix_serve(self._handler, self.unix_path,
+                                                           subprotocols=codec.SUBPROTOCOLS, ping_interval=ping_interval,
+                                                           process_request=self._process_request)
+            logger.debug(f"Unix socket server started ({self.unix_path})")
+
         if self.ssl_cert:
-            async with websockets.serve(self._handler, self.host, self.port, ssl=self.ssl_context) as self.websocket:
+            async with websockets.serve(self._handler, self.host, self.port, ssl=self.ssl_context,
+                                        subprotocols=codec.SUBPROTOCOLS, ping_interval=ping_interval,
+                                        process_request=self._process_request) as self.websocket:
                 logger.debug("Websocket server started")
                 await self.stop
                 logger.debug("Websocket server stopped")
         else:
-            async with websockets.serve(self._handler, self.host, self.port) as self.websocket:
+            async with websockets.serve(self._handler, self.host, self.port, subprotocols=codec.SUBPROTOCOLS,
+                                        ping_interval=ping_interval,
+                                        process_request=self._process_request) as self.websocket:
                 logger.debug("Websocket server started")
                 await self.stop
                 logger.debug("Websocket server stopped")
 
+        if self.unix_server:
+            self.unix_server.close()
+            await self.unix_server.wait_closed()
+            self._remove_socket()
+            logger.debug("Unix socket server stopped")
+
+        if self.loopback:
+            await loopback.stop(self.port)
+
+        if self.liveness:
+            self.liveness.stop()
+
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+
+        if self.journal:
+            self.journal.close()
+
+        if self.tracer:
+            self.tracer.close()
+
+    def _remove_socket(self):
+        """
+        A socket file left by a heart that didn't stop cleanly blocks the bind
+        """
+        try:
+            if stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                os.remove(self.unix_path)
+        except FileNotFoundError:
+            pass
+
     def stop_server(self):
         self.stop.set_result(None)
 
+    async def _process_request(self, path, request_headers):
+        if not self.metrics_path or path != self.metrics_path:
+            return None
+
+        body = self.metrics.prometheus(self.registered_apps, self.connections, self.cache, self.loop_monitor)
+
+        return HTTPStatus.OK, [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')], body.encode()
+
     async def _handler(self, websocket: websockets.WebSocketServerProtocol, path):
-        context = client.Client(self.new_clientid(), self.message_manager, websocket, self.registered_apps)
+        context = client.Client(self.new_clientid(), self.message_manager, websocket, self.registered_apps,
+                                self.connections, self.header_forwarding,
+                                OutboundQueue(websocket, self.queue_size, self.overflow_limit), self.cache,
+                                self.metrics, self.admission, self.tracer, self.loop_monitor)
         self.register(context)
         consumer_task = asyncio.create_task(self._consumer(context))
         await consumer_task
@@ -95,8 +220,24 @@ class Server:
         try:
             async for wsmessage in context.websocket:
                 try:
-                    logger.debug(f"Message from ClientID {context.clientid}: {wsmessage}")
-                    await context.state.handle(wsmessage)
+                    start = self.message_log.start()
+                    context.bytes_in += codec.frame_size(wsmessage)
+                    context.last_seen = time.monotonic()
+                    if self.journal:
+                        self.journal.append(context.clientid,
+                                            context.registration.name if context.registration else None, wsmessage)
+                    handled = time.perf_counter() if self.loop_monitor else None
+                    forwarded = await context.state.forward(wsmessage)
+                    if not forwarded:
+                        await context.state.handle(context.codec.decode(wsmessage))
+                    if handled is not None:
+                        self.loop_monitor.record('forward' if forwarded else 'handle', time.perf_counter() - handled)
+                    if start is not None:
+                        self.message_log.log(start, 'received', client=context.clientid, size=len(wsmessage),
+                                             forwarded=forwarded, message=wsmessage)
+                except exceptions.InvalidMessageError as error:
+                    logger.debug(f"Invalid message from {context}. {error}")
+                    await context.send(msg.Error(f"Invalid message. {error}"))
                 except websockets.ConnectionClosedOK:
                     logger.debug(f"{context} sent message to closed connection")
                     pass
@@ -107,6 +248,7 @@ class Server:
 
     def register(self, context):
         self.connections.add(context)
+        context.outbound.start()
         logger.debug(f"{context} connected")
 
     async def unregister(self, context):
@@ -117,7 +259,11 @@ class Server:
         app_names = list(context.subscriptions.keys())
         [context.remove_subscription(name) for name in app_names]
 
+        await client.cancel_requests(context)
+
         self.connections.remove(context)
+        self.admission.remove(context)
+        context.outbound.stop()
         logger.debug(f"{context} disconnected")
 
     def new_clientid(self):
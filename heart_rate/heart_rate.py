@@ -13,6 +13,10 @@ APPLICATION_NAME = 'Heartrate'
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 4445
 DEFAULT_CONFIG_PATH = f"{str(Path.home())}/.config/Streamheart/Streamheart.conf"
+# Scene switches are outdated after the next health check, a late switch must not be applied
+SWITCH_DEADLINE = stream_bitrate.READ_TIMEOUT
+# update-type: state slot. The heart sends the last event of each slot to new subscribers
+LAST_VALUES = {'StatusChanged': 'status', 'BrbEnabled': 'brb', 'BrbDisabled': 'brb'}
 
 logger = logging.getLogger(__name__)
 streamheart_config = DEFAULT_CONFIG_PATH
@@ -23,6 +27,8 @@ live_scene = None
 current_scene = None
 bad_connection = None
 auto_brb = True
+# The limits are written in a thread with read-modify-write of the whole config, one write at a time
+config_lock = asyncio.Lock()
 
 
 async def request_get_bitrate(message, client, stream):
@@ -54,41 +60,44 @@ async def request_get_brb_status(message, client, stream):
         await client.send(msg.Ok(message.id, enabled=False))
 
 
-async def request_set_brb_limit(message, client, stream):
+def write_limit(option, limit):
+    """
+    Store a bitrate limit in the config. Runs in a thread, reading and writing the file blocks
+    """
     config = ConfigParser()
     config.read(streamheart_config)
+    heartrate_section = config['HEARTRATE']
+
+    with open(streamheart_config, 'w') as configfile:
+        heartrate_section[option] = str(limit)
+        config.write(configfile)
+
 
+async def request_set_brb_limit(message, client, stream):
     try:
-        heartrate_section = config['HEARTRATE']
+        async with config_lock:
+            await asyncio.to_thread(write_limit, 'BRB_BITRATE', message.additionals['limit'])
 
-        with open(streamheart_config, 'w') as configfile:
-            stream.critical_bitrate = message.additionals['limit'] * 1000
-            heartrate_section['BRB_BITRATE'] = str(message.additionals['limit'])
-            config.write(configfile)
-            await client.send(msg.Ok(message.id))
+        stream.critical_bitrate = message.additionals['limit'] * 1000
+        await client.send(msg.Ok(message.id))
     except OSError as error:
         logger.debug(f"Can't set brb limit. {error.strerror}")
-        await client.send(msg.Error("Can't change bitrate limit for BRB"), message.id)
+        await client.send(msg.Error("Can't change bitrate limit for BRB", message.id))
     except KeyError:
         logger.debug(f"Can't set brb limit. Config error")
         await client.send(msg.Error("Can't change bitrate limit for BRB", message.id))
 
 
 async def request_set_low_limit(message, client, stream):
-    config = ConfigParser()
-    config.read(streamheart_config)
-
     try:
-        heartrate_section = config['HEARTRATE']
+        async with config_lock:
+            await asyncio.to_thread(write_limit, 'LOW_BITRATE', message.additionals['limit'])
 
-        with open(streamheart_config, 'w') as configfile:
-            stream.low_bitrate = message.additionals['limit'] * 1000
-            heartrate_section['LOW_BITRATE'] = str(message.additionals['limit'])
-            config.write(configfile)
-            await client.send(msg.Ok(message.id))
+        stream.low_bitrate = message.additionals['limit'] * 1000
+        await client.send(msg.Ok(message.id))
     except OSError as error:
         logger.debug(f"Can't set low limit. {error.strerror}")
-        await client.send(msg.Error("Can't change bitrate limit for LOW"), message.id)
+        await client.send(msg.Error("Can't change bitrate limit for LOW", message.id))
     except KeyError:
         logger.debug(f"Can't set low limit. Config error")
         await client.send(msg.Error("Can't change bitrate limit for LOW", message.id))
@@ -164,34 +173,36 @@ async def run_check_health(client, stream):
             continue
 
         if state is not current_state:
+            # A switch takes up to two OBS requests. They are sent one after the other, the source is only toggled
+            # if the scene switch succeeded
+            requests = []
+
+            if (state is states.OFFLINE or state is states.CRITICAL) and \
+                    (current_state is not states.OFFLINE or current_state is not states.CRITICAL):
+                if state is states.LOW and bad_connection:
+                    requests.append(msg.Request('OBS Studio', 'SetSceneItemProperties', client.message_manager.new_id(),
+                                                **{'item': bad_connection, 'visible': False}))
+
+                requests.append(msg.Request('OBS Studio', 'SetCurrentScene', client.message_manager.new_id(),
+                                            **{'scene-name': brb_scene}))
+            elif state is states.LOW:
+                if current_scene != live_scene:
+                    requests.append(msg.Request('OBS Studio', 'SetCurrentScene', client.message_manager.new_id(),
+                                                **{'scene-name': live_scene}))
+                if bad_connection:
+                    requests.append(msg.Request('OBS Studio', 'SetSceneItemProperties', client.message_manager.new_id(),
+                                                **{'item': bad_connection, 'visible': True}))
+            elif state is states.STABLE:
+                if current_scene != live_scene:
+                    requests.append(msg.Request('OBS Studio', 'SetCurrentScene', client.message_manager.new_id(),
+                                                **{'scene-name': live_scene}))
+                if bad_connection:
+                    requests.append(msg.Request('OBS Studio', 'SetSceneItemProperties', client.message_manager.new_id(),
+                                                **{'item': bad_connection, 'visible': False}))
+
             try:
-                if (state is states.OFFLINE or state is states.CRITICAL) and \
-                        (current_state is not states.OFFLINE or current_state is not states.CRITICAL):
-                    if state is states.LOW and bad_connection:
-                        await client.send_wait(
-                            msg.Request('OBS Studio', 'SetSceneItemProperties', client.message_manager.new_id(),
-                                        **{'item': bad_connection, 'visible': False}))
-
-                    await client.send_wait(msg.Request('OBS Studio', 'SetCurrentScene', client.message_manager.new_id(),
-                                                       **{'scene-name': brb_scene}))
-                elif state is states.LOW:
-                    if current_scene != live_scene:
-                        await client.send_wait(msg.Request('OBS Studio', 'SetCurrentScene',
-                                                           client.message_manager.new_id(),
-                                                           **{'scene-name': live_scene}))
-                    if bad_connection:
-                        await client.send_wait(
-                            msg.Request('OBS Studio', 'SetSceneItemProperties', client.message_manager.new_id(),
-                                        **{'item': bad_connection, 'visible': True}))
-                elif state is states.STABLE:
-                    if current_scene != live_scene:
-                        await client.send_wait(msg.Request('OBS Studio', 'SetCurrentScene',
-                                                           client.message_manager.new_id(),
-                                                           **{'scene-name': live_scene}))
-                    if bad_connection:
-                        await client.send_wait(
-                            msg.Request('OBS Studio', 'SetSceneItemProperties', client.message_manager.new_id(),
-                                        **{'item': bad_connection, 'visible': False}))
+                for request in requests:
+                    await client.send_wait(request, timeout=SWITCH_DEADLINE)
             except exceptions.RequestTimeout as error:
                 logger.debug(f"Request timeout. message-id: {error.message_id}")
             except exceptions.ResponseStatusError as error:
@@ -214,7 +225,9 @@ async def start(config_path=DEFAULT_CONFIG_PATH, host=DEFAULT_HOST, port=DEFAULT
     # Websocket to heart
     subscriptions = ['OBS Studio']
     client = baseclient.Client('heart_rate', (middleware_host, middleware_port), APPLICATION_NAME, subscriptions,
-                               ssl_cert)
+                               ssl_cert, last_values=LAST_VALUES)
+    # Subscribers get the BRB state without asking for it
+    client.keep_last_event(msg.Event('BrbEnabled' if stream.active.is_set() else 'BrbDisabled'))
     client.add_event('SwitchScenes', partial(event_switch_scenes, client=client, stream=stream))
     client.add_event('UnsubscribedFrom', partial(event_unsubscribed_from, client=client, stream=stream))
     client.add_request('GetBitrate', partial(request_get_bitrate, client=client, stream=stream))
@@ -18,6 +18,8 @@ class Unit(Enum):
 
 
 STREAMFILE_PATH = "/usr/local/nginx/rtmp/stream"
+# Seconds without new stream data until the stream is offline
+READ_TIMEOUT = 3.0
 
 logger = logging.getLogger(__name__)
 
@@ -87,7 +89,7 @@ class StreamBitrate:
         await self.active.wait()
 
         try:
-            self.stream = await asyncio.wait_for(self.read_file(), timeout=3.0)
+            self.stream = await asyncio.wait_for(self.read_file(), timeout=READ_TIMEOUT)
         except asyncio.TimeoutError:
             logger.debug("Read stream timeout. No new data. Stream OFFLINE")
             self.stream["bitrate"] = 0
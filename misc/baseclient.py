@@ -1,33 +1,74 @@
 # -*- coding: utf-8 -*-
 
 import ssl
+import time
 import asyncio
 import logging
 import websockets
-from misc import exceptions, message as msg
+from misc import exceptions, codec, constants, tracing, loopback, message as msg
 from misc.backoff import ExponentialBackoff
 from misc.message_manager import MessageManager
+from misc.message_log import MessageLog
+from misc.loop_monitor import LoopMonitor
 
 logger = logging.getLogger(__name__)
+UNIX_SCHEME = 'unix:'
+
+
+def unix_path(address):
+    """
+    Socket path of a heart address with host unix:PATH, None for a TCP address
+    """
+    host = address[0]
+
+    if isinstance(host, str) and host.startswith(UNIX_SCHEME):
+        return host[len(UNIX_SCHEME):]
+
+    return None
 
 
 class Client:
     MAX_RECONNECT_TRIES = 480
-
-    def __init__(self, name, wsserver_address, registration=None, subscriptions=None, ssl_cert=None):
+    PING_INTERVAL = 5
+    PING_TIMEOUT = 5
+    CLOSE_TIMEOUT = 2
+    # Requests of send_many waiting for a response at the same time
+    PIPELINE_CONCURRENCY = 8
+    # Sent by the heart itself, not by subscribed applications
+    HEART_EVENTS = ('error', 'CancelRequest')
+
+    def __init__(self, name, wsserver_address, registration=None, subscriptions=None, ssl_cert=None,
+                 filter_events=True, balancing=None, ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT,
+                 trace_sample=MessageLog.SAMPLE_RATE, tracer=None, lag_interval=LoopMonitor.INTERVAL,
+                 slow_handler=LoopMonitor.THRESHOLD, last_values=None):
         self.name = name
         self.websocket = None
+        self.codec = codec.JsonCodec
         self.wsserver_address = wsserver_address
         self.backoff = ExponentialBackoff()
         self.reconnect_counter = 0
         self.events = {}
         self.add_event('error', lambda message: logger.debug(f"{str(message)}"))
+        self.add_event('CancelRequest', self._cancel_request)
         self.requests = {}
+        self.add_request('GetLoopStats', self._get_loop_stats)
+        self.handlers = {}
         self.message_manager = MessageManager()
         self.registration = registration
+        # update-type: state slot of the registered application. The heart sends the last event of each slot to new
+        # subscribers, the client sends them again after registering on a restarted heart
+        self.last_values = last_values if last_values else {}
+        self.last_events = {}
         self.subscriptions = subscriptions if subscriptions else []
         self.ready = asyncio.Event()
         self.ssl_cert = ssl_cert
+        self.filter_events = filter_events
+        self.balancing = balancing
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.message_log = MessageLog(logger, trace_sample)
+        self.tracer = tracer
+        self.loop_monitor = LoopMonitor(lag_interval, slow_handler) if lag_interval else None
 
         if ssl_cert:
             self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
@@ -36,20 +77,64 @@ class Client:
             self.ssl_context.verify_mode = ssl.CERT_NONE
 
     async def connect(self):
-        if self.ssl_cert:
+        if self.loop_monitor:
+            self.loop_monitor.start()
+
+        if loopback.listening(self.wsserver_address):
+            reconnect = await self._loopback_connect()
+        elif unix_path(self.wsserver_address):
+            reconnect = await self._unix_connect()
+        elif self.ssl_cert:
             reconnect = await self._ssl_connect()
         else:
             reconnect = await self._connect()
 
         logger.debug(f"{self.name} connection closed")
         self.ready.clear()
+        self.message_manager.connection_lost()
         if reconnect is True:
             await self.reconnect()
 
+    async def _loopback_connect(self):
+        """
+        Connection to a heart in this process. Messages are passed as dicts without websocket and serialization
+        """
+        try:
+            async with loopback.connect(self.wsserver_address) as self.websocket:
+                await self._handle()
+        except ConnectionRefusedError as error:
+            logger.debug(f"{error.strerror}")
+        except asyncio.CancelledError:
+            await self.websocket.close()
+            return False
+
+        return True
+
+    async def _unix_connect(self):
+        """
+        Connection to a heart on this host over its Unix socket, without TCP and TLS
+        """
+        try:
+            async with websockets.unix_connect(unix_path(self.wsserver_address), subprotocols=codec.SUBPROTOCOLS,
+                                               ping_interval=self.ping_interval, ping_timeout=self.ping_timeout,
+                                               close_timeout=Client.CLOSE_TIMEOUT) as self.websocket:
+                await self._handle()
+        except (ConnectionRefusedError, FileNotFoundError) as error:
+            logger.debug(f"{error.strerror}")
+        except asyncio.CancelledError:
+            if self.websocket.open:
+                logger.debug(f"{self.name} connection closed from {self.wsserver_address}")
+            await self.websocket.close()
+            return False
+
+        return True
+
     async def _ssl_connect(self):
         try:
             async with websockets.connect(f'wss://{self.wsserver_address[0]}:{self.wsserver_address[1]}',
-                                          ssl=self.ssl_context) as self.websocket:
+                                          ssl=self.ssl_context, subprotocols=codec.SUBPROTOCOLS,
+                                          ping_interval=self.ping_interval, ping_timeout=self.ping_timeout,
+                                          close_timeout=Client.CLOSE_TIMEOUT) as self.websocket:
                 await self._handle()
         except ConnectionRefusedError as error:
             logger.debug(f"{error.strerror}")
@@ -63,8 +148,10 @@ class Client:
 
     async def _connect(self):
         try:
-            async with websockets.connect(
-                    f'ws://{self.wsserver_address[0]}:{self.wsserver_address[1]}') as self.websocket:
+            async with websockets.connect(f'ws://{self.wsserver_address[0]}:{self.wsserver_address[1]}',
+                                          subprotocols=codec.SUBPROTOCOLS, ping_interval=self.ping_interval,
+                                          ping_timeout=self.ping_timeout,
+                                          close_timeout=Client.CLOSE_TIMEOUT) as self.websocket:
                 await self._handle()
         except ConnectionRefusedError as error:
             logger.debug(f"{error.strerror}")
@@ -78,6 +165,7 @@ class Client:
 
     async def _handle(self):
         logger.debug(f"{self.name} connected to {self.websocket.remote_address}")
+        self.codec = codec.get_codec(self.websocket.subprotocol)
         self.reconnect_counter = 0
         self.backoff.reset()
         consumer_task = asyncio.create_task(self.consumer())
@@ -106,29 +194,46 @@ class Client:
     async def _initial(self):
         if self.registration:
             try:
-                await self.send_wait(msg.Request(
-                    'Heart', 'Register', self.message_manager.new_id(), name=self.registration))
+                shared = {'shared': True, 'balancing': self.balancing} if self.balancing else {}
+                last_values = {'last-values': self.last_values} if self.last_values else {}
+                await self.send_wait(msg.Request('Heart', 'Register', self.message_manager.new_id(),
+                                                 name=self.registration, **shared, **last_values))
             except exceptions.RequestTimeout:
                 raise exceptions.RegisterException(f"Can't register {self.registration}. No response from Heart")
             except exceptions.ResponseStatusError as error:
                 raise exceptions.RegisterException(f"Can't register {self.registration}. error: {error}")
 
+            for event in list(self.last_events.values()):
+                additionals = {key: value for key, value in event.additionals.items() if key != msg.TRACE_FIELD}
+                await self.send(msg.Event(event.update_type, **{**additionals, msg.REPLAY_FIELD: True}))
+
         await self.subscribe(*self.subscriptions)
 
     async def consumer(self):
         try:
             async for message in self.websocket:
-                checked_msg = msg.check_message(message)
-                logger.debug(f"Message received: {message}")
+                start = self.message_log.start()
+
+                try:
+                    checked_msg = msg.check_message(self.codec.decode(message))
+                except exceptions.InvalidMessageError:
+                    checked_msg = None
+
+                if start is not None:
+                    self.message_log.log(start, 'received', client=self.name, size=len(message), message=message)
 
                 if type(checked_msg) is msg.Event:
                     try:
-                        asyncio.create_task(self.events[checked_msg.update_type](checked_msg))
+                        asyncio.create_task(self._handler(self.events[checked_msg.update_type], checked_msg))
                     except KeyError:
                         logger.debug(f"Unknown update-type: {checked_msg.update_type}")
                 elif type(checked_msg) is msg.Request:
                     try:
-                        asyncio.create_task(self.requests[checked_msg.request_type](checked_msg))
+                        handler = asyncio.create_task(self._handler(self.requests[checked_msg.request_type],
+                                                                    checked_msg))
+                        self.handlers[checked_msg.id] = handler
+                        handler.add_done_callback(lambda task, request_id=checked_msg.id:
+                                                  self.handlers.pop(request_id, None))
                     except KeyError:
                         logger.debug(f"Unknown request-type: {checked_msg.request_type}")
                         await self.send(msg.Error(f"Invalid request-type: {checked_msg.request_type}", checked_msg.id))
@@ -144,6 +249,33 @@ class Client:
                 f"Connection canceled from {self.wsserver_address} "
                 f"({error.code}, reason: {error.reason if error.reason else 'unknown'})")
 
+    def _handler(self, callback, message):
+        coroutine = callback(message)
+
+        if self.loop_monitor:
+            name = message.request_type if type(message) is msg.Request else message.update_type
+            coroutine = self.loop_monitor.timed(name, coroutine)
+
+        if msg.TRACE_FIELD in message.additionals:
+            return self._traced(coroutine, message)
+
+        return coroutine
+
+    async def _traced(self, coroutine, message):
+        """
+        Handler of a traced request or event. Requests and events sent by the handler continue the trace
+        """
+        trace = message.additionals[msg.TRACE_FIELD]
+        tracing.current_trace.set(trace)
+        start = time.time()
+
+        try:
+            return await coroutine
+        finally:
+            if self.tracer:
+                name = message.request_type if type(message) is msg.Request else message.update_type
+                self.tracer.span(trace, 'handle', start, client=self.name, handler=name)
+
     async def reconnect(self):
         if self.reconnect_counter >= Client.MAX_RECONNECT_TRIES:
             raise exceptions.ReconnectTimeout()
@@ -171,7 +303,7 @@ class Client:
                 for sub in args:
                     if sub not in done:
                         await self.send_wait(msg.Request(
-                            'Heart', 'Subscribe', self.message_manager.new_id(), name=sub))
+                            'Heart', 'Subscribe', self.message_manager.new_id(), name=sub, **self._event_filter()))
                         done.append(sub)
                 break
             except exceptions.RequestTimeout as error:
@@ -193,26 +325,158 @@ class Client:
                 await asyncio.sleep(backoff.delay())
                 continue
 
+    def _event_filter(self):
+        """
+        Subscribe only to update-types with an event callback, the heart doesn't send other events
+        """
+        if not self.filter_events:
+            return {}
+
+        return {'update-types': [update_type for update_type in self.events if update_type not in Client.HEART_EVENTS]}
+
+    def keep_last_event(self, event):
+        """
+        Keep a state event of the registered application. Also used for the initial state, it's sent after the
+        registration
+        """
+        if event.update_type in self.last_values:
+            self.last_events[self.last_values[event.update_type]] = event
+
     async def send(self, message):
         try:
-            logger.debug(f"Message send: {message}")
-            await self.websocket.send(str(message))
+            if type(message) is msg.Event:
+                self.keep_last_event(message)
+
+                if msg.TRACE_FIELD not in message.additionals:
+                    trace = tracing.current_trace.get()
+
+                    if trace is not None:
+                        message.additionals[msg.TRACE_FIELD] = trace
+
+            start = self.message_log.start()
+            frame = self.codec.encode(message)
+
+            if start is not None:
+                self.message_log.log(start, 'send', client=self.name, size=len(frame), message=message)
+
+            await self.websocket.send(frame)
         except websockets.ConnectionClosedOK:
             logger.debug("Can't send. Connection is closed")
 
-    async def send_wait(self, message):
+    async def send_wait(self, message, timeout=MessageManager.MAX_WAIT_TIME):
+        """
+        Send a request and wait for its response. The timeout is sent as deadline of the request, the heart and the
+        application don't work on it anymore after the deadline.
+        The request continues the trace of the current handler. With a tracer a new trace starts otherwise, except for
+        requests to the heart
+        """
+        trace = message.trace if message.trace else tracing.current_trace.get()
+
+        if trace is None and self.tracer and message.application != constants.MIDDLEWARE_APPLICATION_NAME:
+            trace = tracing.new_trace_id()
+
+        if trace is not None:
+            message.trace = trace
+
+        sent = time.time()
+
         try:
-            logger.debug(f"Message send: {message}")
-            await self.websocket.send(str(message))
-            request_future = self.message_manager.add_request(message)
+            if message.deadline is None:
+                message.deadline = timeout
+
+            start = self.message_log.start()
+            frame = self.codec.encode(message)
+
+            if start is not None:
+                self.message_log.log(start, 'send', client=self.name, size=len(frame), message=message)
+
+            await self.websocket.send(frame)
+            request_future = self.message_manager.add_request(message, timeout)
             await request_future
 
             if request_future.result().status is msg.Status.ERROR:
                 raise exceptions.ResponseStatusError(request_future.result().error, request_future.result().id)
+            elif request_future.result().status is msg.Status.REJECTED:
+                raise exceptions.RequestRejected(request_future.result().error, request_future.result().id,
+                                                 request_future.result().additionals.get('retry-after'))
 
             return request_future.result()
         except websockets.ConnectionClosedOK:
             logger.debug("Can't send. Connection is closed")
+        finally:
+            if self.tracer and trace is not None:
+                self.tracer.span(trace, 'request', sent, client=self.name, application=message.application,
+                                 **{'request-type': message.request_type, 'message-id': message.id})
+
+    def send_many(self, requests, timeout=MessageManager.MAX_WAIT_TIME, concurrency=PIPELINE_CONCURRENCY):
+        """
+        Send requests back-to-back without waiting for each response. At most concurrency requests wait for a
+        response at the same time, the others are sent as responses arrive. Returns a task per request in the order
+        of the requests, each resolves like send_wait. Requests without trace share one trace.
+        Only for independent requests, a request is sent even if an earlier one failed
+        """
+        trace = tracing.current_trace.get()
+
+        if trace is None and self.tracer:
+            trace = tracing.new_trace_id()
+
+        if trace is not None:
+            for request in requests:
+                if not request.trace and request.application != constants.MIDDLEWARE_APPLICATION_NAME:
+                    request.trace = trace
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(request):
+            async with semaphore:
+                return await self.send_wait(request, timeout)
+
+        tasks = [asyncio.create_task(send(request)) for request in requests]
+
+        # Errors of requests after a failed one aren't raised by gather_requests, they are retrieved here
+        for task in tasks:
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+        return tasks
+
+    async def gather_requests(self, requests, timeout=MessageManager.MAX_WAIT_TIME, concurrency=PIPELINE_CONCURRENCY,
+                              return_exceptions=False):
+        """
+        Send requests with send_many and wait for all responses. Returns the responses in the order of the requests.
+        The first failed request raises its exception like send_wait, with return_exceptions the exceptions are
+        returned in place of the responses
+        """
+        return await asyncio.gather(*self.send_many(requests, timeout, concurrency),
+                                    return_exceptions=return_exceptions)
+
+    async def broadcast(self, request_type, applications=None, timeout=MessageManager.MAX_WAIT_TIME, **additionals):
+        """
+        Send a request to several or all registered applications at once. The heart answers with the response of each
+        application in results and the applications without response before the timeout in timeouts
+        """
+        targets = {'applications': list(applications)} if applications is not None else {}
+
+        return await self.send_wait(msg.Request(constants.MIDDLEWARE_APPLICATION_NAME, 'Broadcast',
+                                                self.message_manager.new_id(),
+                                                request={'request-type': request_type, **additionals}, **targets),
+                                    timeout)
+
+    async def _cancel_request(self, event):
+        """
+        The requester of a request disconnected. Its handler task is cancelled, the response isn't read anymore
+        """
+        handler = self.handlers.pop(event.additionals.get('request-id'), None)
+
+        if handler:
+            handler.cancel()
+            logger.debug(f"Request handler cancelled (message-id: {event.additionals['request-id']})")
+
+    async def _get_loop_stats(self, request):
+        if not self.loop_monitor:
+            await self.send(msg.Error("Loop monitor is disabled", request.id))
+            return
+
+        await self.send(msg.Ok(request.id, **self.loop_monitor.stats()))
 
     def add_event(self, name, callback):
         self.events[name] = callback
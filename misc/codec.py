@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import json
+from misc import exceptions, message as msg
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SUBPROTOCOL_JSON = 'streamheart.json'
+SUBPROTOCOL_MSGPACK = 'streamheart.msgpack'
+# Not negotiated over websockets, only used by in-process loopback connections
+SUBPROTOCOL_LOOPBACK = 'streamheart.loopback'
+
+
+class JsonCodec:
+    """
+    Default wire format. Text frames with JSON objects, used by clients without a negotiated subprotocol
+    """
+    subprotocol = SUBPROTOCOL_JSON
+    binary = False
+
+    @staticmethod
+    def encode(message):
+        if isinstance(message, dict):
+            return json.dumps(message)
+
+        return str(message)
+
+    @staticmethod
+    def decode(frame):
+        return msg.decode(frame)
+
+
+class MsgpackCodec:
+    """
+    Binary frames with MessagePack maps. Only available if msgpack is installed
+    """
+    subprotocol = SUBPROTOCOL_MSGPACK
+    binary = True
+
+    @staticmethod
+    def encode(message):
+        if not isinstance(message, dict):
+            message = message.as_dict()
+
+        return msgpack.packb(message)
+
+    @staticmethod
+    def decode(frame):
+        try:
+            message = msgpack.unpackb(frame, raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException):
+            raise exceptions.InvalidMessageError("Message is not a MessagePack map")
+
+        if not isinstance(message, dict):
+            raise exceptions.InvalidMessageError("Message is not a MessagePack map")
+
+        return message
+
+
+class LoopbackCodec:
+    """
+    Messages of loopback connections are passed as dicts without serialization. Every receiver gets its own copy
+    because parsing takes the fields out of the dict, e.g. for events broadcast to several subscribers
+    """
+    subprotocol = SUBPROTOCOL_LOOPBACK
+    binary = True
+
+    @staticmethod
+    def encode(message):
+        if isinstance(message, dict):
+            return message
+
+        if isinstance(message, str):
+            return msg.decode(message)
+
+        return message.as_dict()
+
+    @staticmethod
+    def decode(frame):
+        if not isinstance(frame, dict):
+            raise exceptions.InvalidMessageError("Message is not a dict")
+
+        return dict(frame)
+
+
+CODECS = {SUBPROTOCOL_JSON: JsonCodec, SUBPROTOCOL_LOOPBACK: LoopbackCodec}
+
+if msgpack:
+    CODECS[SUBPROTOCOL_MSGPACK] = MsgpackCodec
+
+# Offered and accepted subprotocols, most preferred first
+SUBPROTOCOLS = [codec.subprotocol for codec in (MsgpackCodec, JsonCodec) if codec.subprotocol in CODECS]
+
+
+def get_codec(subprotocol):
+    return CODECS.get(subprotocol, JsonCodec)
+
+
+def frame_size(frame):
+    """
+    Bytes of a frame on the wire. Text frames are sent UTF-8 encoded, loopback dicts are never serialized
+    """
+    if isinstance(frame, str):
+        return len(frame) if frame.isascii() else len(frame.encode())
+
+    if isinstance(frame, dict):
+        return 0
+
+    return len(frame)
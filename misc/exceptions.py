@@ -73,6 +73,12 @@ class RequestTimeout(Exception):
         self.message_id = message_id
 
 
+class ConnectionLost(RequestTimeout):
+    """
+    Raised if the connection closed before the response was received
+    """
+
+
 class ResponseStatusError(Exception):
     """
     Raised if the response status is error
@@ -82,6 +88,15 @@ class ResponseStatusError(Exception):
         self.message_id = message_id
 
 
+class RequestRejected(ResponseStatusError):
+    """
+    Raised if the heart rejected the request because a rate or in-flight limit is exceeded
+    """
+    def __init__(self, error, message_id, retry_after=None):
+        super().__init__(error, message_id)
+        self.retry_after = retry_after
+
+
 class ConfigError(Exception):
     """
     Raised if the config file is invalid
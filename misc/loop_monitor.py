@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import logging
+import collections
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+
+def install_uvloop():
+    """
+    Use uvloop for the event loops of this process if it is installed. Returns True if it is used
+    """
+    if not uvloop:
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    return True
+
+
+def loop_name():
+    loop = asyncio.get_running_loop()
+
+    return 'uvloop' if type(loop).__module__.startswith('uvloop') else 'asyncio'
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        # Wall time from start to end of the handler, including awaited I/O
+        self.wall = 0
+        self.max_wall = 0
+        # Time the handler ran on the loop, the longest step blocked all other handlers
+        self.busy = 0
+        self.max_step = 0
+        self.slow = 0
+
+    def record(self, wall, busy, longest, slow):
+        self.calls += 1
+        self.wall += wall
+        self.max_wall = max(self.max_wall, wall)
+        self.busy += busy
+        self.max_step = max(self.max_step, longest)
+        self.slow += slow
+
+    def stats(self):
+        return {'calls': self.calls, 'wall': self.wall, 'max-wall': self.max_wall, 'busy': self.busy,
+                'max-step': self.max_step, 'slow': self.slow}
+
+
+class Steps:
+    """
+    Awaitable that runs a coroutine and times each step it runs on the loop until its next await
+    """
+
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+        self.busy = 0
+        self.longest = 0
+
+    def __await__(self):
+        value, error = None, None
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                future = self.coroutine.throw(error) if error is not None else self.coroutine.send(value)
+            except StopIteration as stop:
+                self._step(start)
+                return stop.value
+            except BaseException:
+                self._step(start)
+                raise
+
+            self._step(start)
+
+            try:
+                value, error = (yield future), None
+            except BaseException as exception:
+                value, error = None, exception
+
+    def _step(self, start):
+        step = time.perf_counter() - start
+        self.busy += step
+        self.longest = max(self.longest, step)
+
+
+class LoopMonitor:
+    """
+    Samples the lag of the event loop and accounts the time of message handlers. A sleep of the sampler that ends
+    late shows how long the loop was blocked. A handler that runs longer than the threshold without awaiting
+    blocks every other handler and is logged as slow
+    """
+    INTERVAL = 0.5
+    THRESHOLD = 0.05
+    # Lag samples kept for the percentiles
+    WINDOW = 1000
+
+    def __init__(self, interval=INTERVAL, threshold=THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.task = None
+        self.lags = collections.deque(maxlen=LoopMonitor.WINDOW)
+        self.max_lag = 0
+        self.stalls = 0
+        self.handlers = {}
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag >= self.threshold:
+                self.stalls += 1
+                logger.warning(f"Event loop blocked for {lag * 1000:.1f} ms")
+
+    def handler(self, name):
+        try:
+            return self.handlers[name]
+        except KeyError:
+            self.handlers[name] = HandlerStats()
+            return self.handlers[name]
+
+    def record(self, name, wall, busy=None, longest=None):
+        """
+        Time of a handler. Without busy and longest it ran on the loop without awaiting
+        """
+        busy = wall if busy is None else busy
+        longest = wall if longest is None else longest
+        slow = longest >= self.threshold
+        self.handler(name).record(wall, busy, longest, slow)
+
+        if slow:
+            logger.warning(f"Slow handler {name} blocked the event loop for {longest * 1000:.1f} ms "
+                           f"(wall time: {wall * 1000:.1f} ms)")
+
+    async def timed(self, name, coroutine):
+        steps = Steps(coroutine)
+        start = time.perf_counter()
+
+        try:
+            return await steps
+        finally:
+            self.record(name, time.perf_counter() - start, steps.busy, steps.longest)
+
+    def lag(self):
+        lags = sorted(self.lags)
+
+        if not lags:
+            return {'last': 0, 'mean': 0, 'p50': 0, 'p99': 0, 'max': self.max_lag}
+
+        return {'last': self.lags[-1], 'mean': sum(lags) / len(lags), 'p50': lags[len(lags) // 2],
+                'p99': lags[min(int(len(lags) * 0.99), len(lags) - 1)], 'max': self.max_lag}
+
+    def stats(self):
+        return {'loop': loop_name(), 'interval': self.interval, 'threshold': self.threshold, 'lag': self.lag(),
+                'stalls': self.stalls, 'handlers': {name: handler.stats() for name, handler in self.handlers.items()}}
+
+    def __repr__(self):
+        return f"LoopMonitor(interval: {self.interval}, threshold: {self.threshold}, stalls: {self.stalls})"
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import websockets
+from websockets.frames import Close
+from misc import codec
+
+logger = logging.getLogger(__name__)
+
+HOST = 'loopback'
+NORMAL_CLOSURE = 1000
+GOING_AWAY = 1001
+ABNORMAL_CLOSURE = 1006
+# Port: Listener of an in-process heart
+LISTENERS = {}
+
+
+class Connection:
+    """
+    One end of an in-memory connection between an in-process heart and a client. It has the interface of a
+    websocket connection that heart and clients use, messages are passed as dicts without serialization
+    """
+
+    def __init__(self, local_address, remote_address):
+        self.subprotocol = codec.SUBPROTOCOL_LOOPBACK
+        self.local_address = local_address
+        self.remote_address = remote_address
+        self.peer = None
+        self.incoming = asyncio.Queue()
+        self.close_frame = None
+        self.transport = Transport(self)
+
+    @property
+    def open(self):
+        return self.close_frame is None
+
+    @property
+    def closed(self):
+        return self.close_frame is not None
+
+    async def send(self, frame):
+        if self.close_frame:
+            raise self._closed_exception()
+
+        self.peer.incoming.put_nowait(frame)
+
+    async def recv(self):
+        if self.close_frame and self.incoming.empty():
+            raise self._closed_exception()
+
+        frame = await self.incoming.get()
+
+        if frame is None:
+            raise self._closed_exception()
+
+        return frame
+
+    async def ping(self, data=None):
+        """
+        The peer runs in the same process, it answers at once while the connection is open
+        """
+        if self.close_frame:
+            raise self._closed_exception()
+
+        pong = asyncio.get_running_loop().create_future()
+        pong.set_result(None)
+
+        return pong
+
+    async def close(self, code=NORMAL_CLOSURE, reason=''):
+        self.abort(code, reason)
+
+    def abort(self, code=ABNORMAL_CLOSURE, reason=''):
+        for end in (self, self.peer):
+            if end.close_frame is None:
+                end.close_frame = Close(code, reason)
+                end.incoming.put_nowait(None)
+
+    def _closed_exception(self):
+        if self.close_frame.code in (NORMAL_CLOSURE, GOING_AWAY):
+            return websockets.ConnectionClosedOK(self.close_frame, self.close_frame, True)
+
+        return websockets.ConnectionClosedError(self.close_frame, self.close_frame, True)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except websockets.ConnectionClosedOK:
+            raise StopAsyncIteration
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    def __repr__(self):
+        return f"Connection(local_address: {self.local_address}, remote_address: {self.remote_address}, " \
+               f"open: {self.open})"
+
+
+class Transport:
+    """
+    Transport of a connection, aborting it closes both ends at once
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def abort(self):
+        self.connection.abort()
+
+
+class Listener:
+    """
+    Accepts in-process connections for the handler of a heart
+    """
+
+    def __init__(self, port, handler):
+        self.port = port
+        self.handler = handler
+        self.connections = set()
+        self.counter = 0
+
+    def connect(self):
+        self.counter += 1
+        client = Connection((HOST, self.counter), (HOST, self.port))
+        server = Connection((HOST, self.port), (HOST, self.counter))
+        client.peer, server.peer = server, client
+        self.connections.add(server)
+        task = asyncio.create_task(self.handler(server, '/'))
+        task.add_done_callback(lambda _: self.connections.discard(server))
+        logger.debug(f"Loopback connection {self.counter} to port {self.port}")
+
+        return client
+
+    async def close(self):
+        for connection in list(self.connections):
+            await connection.close(GOING_AWAY, "Heart stopped")
+
+
+def listen(port, handler):
+    LISTENERS[port] = Listener(port, handler)
+
+
+async def stop(port):
+    listener = LISTENERS.pop(port, None)
+
+    if listener:
+        await listener.close()
+
+
+def listening(address):
+    """
+    True if a heart in this process accepts loopback connections on the port of address
+    """
+    return address[1] in LISTENERS
+
+
+def connect(address):
+    try:
+        return LISTENERS[address[1]].connect()
+    except KeyError:
+        raise ConnectionRefusedError(111, f"No loopback listener on port {address[1]}")
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import re
 import json
 from enum import Enum
 from misc import exceptions
@@ -7,38 +8,140 @@ from misc import exceptions
 REQUEST_FIELDS = ('application', 'request-type', 'message-id')
 RESPONSE_FIELDS = ('message-id', 'status', 'error')
 EVENT_FIELDS = ('update-type',)
+# Optional request field. Seconds left to answer the request, counted from sending the message
+DEADLINE_FIELD = 'deadline'
+# Optional request and event field. Trace ID kept by every hop to record the spans of the message
+TRACE_FIELD = 'trace'
+# Event field of state events that report the current state and not a change. Set by the heart on the last state
+# events replayed to a new subscriber and by applications that send their state again after registering
+REPLAY_FIELD = 'replay'
+HEADER_FIELDS = (*REQUEST_FIELDS, *RESPONSE_FIELDS[1:2], *EVENT_FIELDS, DEADLINE_FIELD, TRACE_FIELD)
+HEADER_VALUE = re.compile(r'\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)')
+HEADER_KEY = re.compile(r'\s*:')
+# Strings and brackets of a JSON message, enough to know the nesting depth of a key
+HEADER_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
 
 
 class Status(str, Enum):
     ERROR = 'error'
     OK = 'ok'
+    REJECTED = 'rejected'
+
+
+def decode(message):
+    if isinstance(message, dict):
+        return message
+
+    try:
+        message = json.loads(message)
+    except (json.JSONDecodeError, TypeError):
+        raise exceptions.InvalidMessageError("Message is not a JSON object")
+
+    if not isinstance(message, dict):
+        raise exceptions.InvalidMessageError("Message is not a JSON object")
+
+    return message
 
 
 def check_message(message):
     msg_class = None
 
     try:
+        message = decode(message)
+    except exceptions.InvalidMessageError:
+        return msg_class
+
+    if EVENT_FIELDS[0] in message:
         try:
-            Event.check(message)
-            return Event(message=message, check=False)
+            return Event(message=Event.validate(message), check=False)
         except exceptions.InvalidEventError:
             pass
+    if REQUEST_FIELDS[0] in message:
         try:
-            Request.check(message)
-            return Request(message=message, check=False)
+            return Request(message=Request.validate(message), check=False)
         except exceptions.InvalidRequestError:
             pass
+    if RESPONSE_FIELDS[0] in message:
         try:
-            Response.check(message)
-            return Response(message=message, check=False)
+            return Response(message=Response.validate(message), check=False)
         except exceptions.InvalidResponseError:
             pass
-    except exceptions.InvalidMessageError:
-        return msg_class
 
     return msg_class
 
 
+def peek_header(message):
+    """
+    Extract the routing fields of a JSON request or response without decoding the payload.
+    Returns None if the message needs to be decoded completely (events, ambiguous or invalid fields)
+    """
+    if type(message) is not str:
+        return None
+
+    # Only keys of the top level object are routing fields, the same keys may be nested anywhere in the payload
+    keys = []
+
+    for field in (*HEADER_FIELDS, RESPONSE_FIELDS[2]):
+        key = f'"{field}"'
+        start = message.find(key)
+
+        while start != -1:
+            keys.append((start, field, key))
+            start = message.find(key, start + 1)
+
+    keys.sort()
+    fields = {}
+    depth, position = 0, 0
+
+    for start, field, key in keys:
+        for token in HEADER_TOKEN.finditer(message, position, start):
+            bracket = message[token.start()]
+
+            if bracket == '{' or bracket == '[':
+                depth += 1
+            elif bracket == '}' or bracket == ']':
+                depth -= 1
+
+        position = start
+
+        if depth != 1 or not HEADER_KEY.match(message, start + len(key)):
+            continue
+
+        if field in fields:
+            return None
+
+        # The error is only checked to be present, an ok response may contain "error": null
+        value = True if field == RESPONSE_FIELDS[2] else HEADER_VALUE.match(message, start + len(key))
+
+        if not value:
+            return None
+
+        fields[field] = value
+
+    if EVENT_FIELDS[0] in fields:
+        return None
+
+    try:
+        if all(field in fields for field in REQUEST_FIELDS) and RESPONSE_FIELDS[1] not in fields:
+            fields.pop(RESPONSE_FIELDS[2], None)
+            return Header(Request, message, fields)
+
+        if all(field in fields for field in RESPONSE_FIELDS[:2]) and \
+                REQUEST_FIELDS[0] not in fields and REQUEST_FIELDS[1] not in fields:
+            error = fields.pop(RESPONSE_FIELDS[2], None)
+            header = Header(Response, message, fields)
+
+            # Same as Response.validate, a failed response has to tell why
+            if header.status != Status.OK and not error:
+                return None
+
+            return header
+    except exceptions.MessageError:
+        return None
+
+    return None
+
+
 class Request:
     def __init__(self, application: str = None, request_type: str = None, message_id: int = None, message=None,
                  check=True, **kwargs):
@@ -57,7 +160,7 @@ class Request:
         if check:
             message = Request.check(message)
         else:
-            message = json.loads(message)
+            message = decode(message)
 
         self.application = message.pop(REQUEST_FIELDS[0])
         self.request_type = message.pop(REQUEST_FIELDS[1])
@@ -67,10 +170,14 @@ class Request:
     @staticmethod
     def check(message):
         try:
-            message = json.loads(message)
-        except json.JSONDecodeError:
+            message = decode(message)
+        except exceptions.InvalidMessageError:
             raise exceptions.InvalidMessageError("Request is not a JSON object")
 
+        return Request.validate(message)
+
+    @staticmethod
+    def validate(message):
         application, request_type, message_id = None, None, None
 
         try:
@@ -86,10 +193,28 @@ class Request:
 
         return message
 
+    def as_dict(self):
+        return {**{REQUEST_FIELDS[0]: self.application, REQUEST_FIELDS[1]: self.request_type,
+                   REQUEST_FIELDS[2]: self.id}, **self.additionals}
+
+    @property
+    def deadline(self):
+        return self.additionals.get(DEADLINE_FIELD)
+
+    @deadline.setter
+    def deadline(self, deadline):
+        self.additionals[DEADLINE_FIELD] = deadline
+
+    @property
+    def trace(self):
+        return self.additionals.get(TRACE_FIELD)
+
+    @trace.setter
+    def trace(self, trace):
+        self.additionals[TRACE_FIELD] = trace
+
     def __repr__(self):
-        return json.dumps(
-            {**{REQUEST_FIELDS[0]: self.application, REQUEST_FIELDS[1]: self.request_type, REQUEST_FIELDS[2]: self.id},
-             **self.additionals})
+        return json.dumps(self.as_dict())
 
 
 class Response:
@@ -103,7 +228,7 @@ class Response:
         if message:
             self.parse(message, check)
         else:
-            if self.status is not Status.OK and self.status is not Status.ERROR:
+            if not isinstance(self.status, Status):
                 raise ValueError("status must be from class Status")
 
             if self.status is Status.OK and (not self.id and self.id != 0):
@@ -113,7 +238,7 @@ class Response:
         if check:
             message = Response.check(message)
         else:
-            message = json.loads(message)
+            message = decode(message)
 
         self.id = int(message.pop(RESPONSE_FIELDS[0]))
 
@@ -125,17 +250,21 @@ class Response:
 
         self.status = Status[message.pop(RESPONSE_FIELDS[1]).upper()]
 
-        if self.status == Status.ERROR:
+        if self.status != Status.OK:
             self.error = message.pop(RESPONSE_FIELDS[2])
         self.additionals = message
 
     @staticmethod
     def check(message):
         try:
-            message = json.loads(message)
-        except json.JSONDecodeError:
+            message = decode(message)
+        except exceptions.InvalidMessageError:
             raise exceptions.InvalidMessageError("Response is not a JSON object")
 
+        return Response.validate(message)
+
+    @staticmethod
+    def validate(message):
         message_id, status, error = None, None, None
 
         try:
@@ -149,7 +278,7 @@ class Response:
 
             status = message[RESPONSE_FIELDS[1]]
 
-            if status == Status.ERROR:
+            if status != Status.OK:
                 error = message[RESPONSE_FIELDS[2]]
         except KeyError as key_error:
             raise exceptions.InvalidResponseError(f"Response doesn't match the protocol. Missing field: {key_error}",
@@ -163,10 +292,12 @@ class Response:
 
         return message
 
+    def as_dict(self):
+        return {**{RESPONSE_FIELDS[0]: self.id, RESPONSE_FIELDS[1]: self.status, RESPONSE_FIELDS[2]: self.error},
+                **self.additionals}
+
     def __repr__(self):
-        return json.dumps(
-            {**{RESPONSE_FIELDS[0]: self.id, RESPONSE_FIELDS[1]: self.status, RESPONSE_FIELDS[2]: self.error},
-             **self.additionals})
+        return json.dumps(self.as_dict())
 
 
 class Event:
@@ -184,7 +315,7 @@ class Event:
         if check:
             message = Event.check(message)
         else:
-            message = json.loads(message)
+            message = decode(message)
 
         self.update_type = message.pop(EVENT_FIELDS[0])
         self.additionals = message
@@ -192,10 +323,14 @@ class Event:
     @staticmethod
     def check(message):
         try:
-            message = json.loads(message)
-        except json.JSONDecodeError:
+            message = decode(message)
+        except exceptions.InvalidMessageError:
             raise exceptions.InvalidMessageError("Event is not a JSON object")
 
+        return Event.validate(message)
+
+    @staticmethod
+    def validate(message):
         update_type = None
 
         try:
@@ -208,9 +343,11 @@ class Event:
 
         return message
 
+    def as_dict(self):
+        return {**{EVENT_FIELDS[0]: self.update_type}, **self.additionals}
+
     def __repr__(self):
-        return json.dumps(
-            {**{EVENT_FIELDS[0]: self.update_type}, **self.additionals})
+        return json.dumps(self.as_dict())
 
 
 class Ok(Response):
@@ -221,3 +358,87 @@ class Ok(Response):
 class Error(Response):
     def __init__(self, error_msg: str, message_id: int = None):
         super().__init__(message_id, Status.ERROR, error_msg)
+
+
+class Rejected(Response):
+    def __init__(self, error_msg: str, message_id: int = None, **kwargs):
+        super().__init__(message_id, Status.REJECTED, error_msg, **kwargs)
+
+
+class Header:
+    """
+    Routing fields of an undecoded JSON request or response.
+    Only the message-id and deadline are rewritten, the payload is passed on as received
+    """
+    def __init__(self, kind, message, fields):
+        self.kind = kind
+        self.message = message
+        self.application = None
+        self.request_type = None
+        self.status = None
+        self.deadline = self._original_deadline = None
+        self.trace = None
+
+        try:
+            values = {field: json.loads(value.group(1)) for field, value in fields.items()}
+        except json.JSONDecodeError:
+            raise exceptions.InvalidMessageError("Message header is not valid JSON", None)
+
+        self._id_span = fields[REQUEST_FIELDS[2]].span(1)
+        self.id = self._original_id = values[REQUEST_FIELDS[2]]
+
+        if kind is Request:
+            self.application = values[REQUEST_FIELDS[0]]
+            self.request_type = values[REQUEST_FIELDS[1]]
+
+            if DEADLINE_FIELD in fields:
+                self._deadline_span = fields[DEADLINE_FIELD].span(1)
+                self.deadline = self._original_deadline = values[DEADLINE_FIELD]
+
+            self.trace = values.get(TRACE_FIELD)
+
+            if type(self.application) is not str or not self.application or not self.request_type:
+                raise exceptions.InvalidRequestError("Required request field is not set", self.id)
+        else:
+            try:
+                self.id = self._original_id = int(self.id)
+                self.status = Status(values[RESPONSE_FIELDS[1]].lower())
+            except (ValueError, AttributeError) as error:
+                raise exceptions.InvalidResponseError(str(error), self.id)
+
+    @property
+    def additionals(self):
+        fields = REQUEST_FIELDS if self.kind is Request else RESPONSE_FIELDS
+
+        return {key: value for key, value in decode(self.message).items() if key not in fields}
+
+    def as_dict(self):
+        message = decode(self.message)
+        message[REQUEST_FIELDS[2]] = self.id
+
+        if self.deadline is not None:
+            message[DEADLINE_FIELD] = self.deadline
+
+        return message
+
+    def __repr__(self):
+        replacements = []
+
+        if self.id != self._original_id:
+            replacements.append((self._id_span, self.id))
+
+        if self.deadline != self._original_deadline:
+            replacements.append((self._deadline_span, self.deadline))
+
+        if not replacements:
+            return self.message
+
+        parts, position = [], 0
+
+        for (start, end), value in sorted(replacements):
+            parts.extend((self.message[position:start], json.dumps(value)))
+            position = end
+
+        parts.append(self.message[position:])
+
+        return ''.join(parts)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+
+
+class MessageLog:
+    """
+    Structured log of the messages on hot paths. While debug logging and sampling are off a message only costs the
+    call of start(), its fields are formatted only if it's logged.
+    With a sample rate of N every Nth message is logged at INFO with its handling time
+    """
+    SAMPLE_RATE = 0
+    MAX_VALUE_LENGTH = 500
+
+    def __init__(self, logger, sample_rate=SAMPLE_RATE):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.count = 0
+
+    def start(self):
+        """
+        Start time of a message that is logged, None if it isn't logged
+        """
+        if self.sample_rate:
+            self.count += 1
+
+            if self.count >= self.sample_rate:
+                self.count = 0
+
+                if self.logger.isEnabledFor(logging.INFO):
+                    return time.perf_counter()
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            return time.perf_counter()
+
+        return None
+
+    def log(self, start, event, **fields):
+        """
+        Debug logs contain the complete values, sampled logs shorten long values like screenshots
+        """
+        fields['duration-us'] = round((time.perf_counter() - start) * 1000000, 1)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            level, values = logging.DEBUG, fields.items()
+        else:
+            level, values = logging.INFO, ((key, self._shorten(value)) for key, value in fields.items())
+
+        self.logger.log(level, "%s %s", event, ' '.join(f'{key}={value}' for key, value in values),
+                        extra={'event': event, 'fields': fields})
+
+    @staticmethod
+    def _shorten(value):
+        value = str(value)
+
+        if len(value) > MessageLog.MAX_VALUE_LENGTH:
+            return f'{value[:MessageLog.MAX_VALUE_LENGTH]}...'
+
+        return value
+
+    def __repr__(self):
+        return f"MessageLog(logger: {self.logger.name}, sample_rate: {self.sample_rate})"
@@ -2,7 +2,9 @@
 
 import asyncio
 import logging
+import itertools
 from misc import exceptions
+from misc.timer_wheel import TimerWheel
 
 logger = logging.getLogger(__name__)
 
@@ -11,37 +13,52 @@ class MessageManager:
     MAX_WAIT_TIME = 6
 
     def __init__(self):
-        self.id = 0
+        # next() of a count is atomic, concurrent tasks and threads never get the same message-id
+        self.ids = itertools.count()
         self.request_awaits = {}
+        self.timeouts = TimerWheel(self.requests_timeout)
 
     def new_id(self):
-        self.id, old_id = self.id + 1, self.id
-        return old_id
+        return next(self.ids)
 
-    def add_request(self, request):
+    def add_request(self, request, timeout=MAX_WAIT_TIME):
         message_id = request.id
-        loop = asyncio.get_event_loop()
-        request_future = loop.create_future()
-        loop.create_task(self.request_timeout(message_id, request_future))
+        request_future = asyncio.get_event_loop().create_future()
         self.request_awaits[message_id] = request_future
+        self.timeouts.add(message_id, timeout)
 
         return request_future
 
-    async def request_timeout(self, request_id, future):
-        try:
-            await asyncio.wait_for(asyncio.shield(future), MessageManager.MAX_WAIT_TIME)
-        except asyncio.TimeoutError:
-            future.set_exception(exceptions.RequestTimeout(request_id))
-            logger.debug(f"Awaited request timeout (message-id: {request_id})")
-        finally:
-            try:
-                self.request_awaits.pop(request_id)
-            except KeyError:
-                logger.debug(f"Timeouted request isn't in request_awaits anymore (message-id: {request_id})")
+    def requests_timeout(self, request_ids):
+        for request_id in request_ids:
+            future = self.request_awaits.pop(request_id, None)
+
+            if future and not future.done():
+                future.set_exception(exceptions.RequestTimeout(request_id))
+                logger.debug(f"Awaited request timeout (message-id: {request_id})")
+
+    def connection_lost(self):
+        """
+        Fails all awaited requests at once, their responses can't arrive anymore
+        """
+        request_ids = list(self.request_awaits)
+
+        for request_id in request_ids:
+            future = self.request_awaits.pop(request_id)
+            self.timeouts.remove(request_id)
+
+            if not future.done():
+                future.set_exception(exceptions.ConnectionLost(request_id))
+
+        if request_ids:
+            logger.debug(f"Connection lost. {len(request_ids)} awaited requests failed")
 
     def response_received(self, response):
         try:
-            request = self.request_awaits[response.id]
-            request.set_result(response)
+            request = self.request_awaits.pop(response.id)
+            self.timeouts.remove(response.id)
+
+            if not request.done():
+                request.set_result(response)
         except KeyError:
             logger.debug(f"Response discarded. Request isn't in request_awaits. message-id: {response.id}")
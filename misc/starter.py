@@ -4,6 +4,7 @@ import os
 import signal
 import logging
 from pathlib import Path
+from misc import loop_monitor
 
 logger = logging.getLogger(__name__)
 
@@ -95,6 +96,9 @@ def run(application_name, callback, arguementparser):
 
     logger.info(f"{application_name} started")
 
+    if loop_monitor.install_uvloop():
+        logger.info(f"{application_name} uses uvloop")
+
     if not args.debug:
         logging.basicConfig(level=logging.ERROR)
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import math
+import asyncio
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for request timeouts. Keys are hashed into slots by their deadline tick and expired keys
+    are passed in batches to on_expire. One loop timer is armed while keys are pending, none per key
+    """
+    TICK = 0.1
+    SLOTS = 256
+
+    def __init__(self, on_expire, tick=TICK, slots=SLOTS):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}
+        self.current = 0
+        self.timer = None
+
+    def add(self, key, timeout):
+        loop = asyncio.get_event_loop()
+        self.remove(key)
+
+        if not self.timer:
+            self.current = int(loop.time() / self.tick)
+            self.timer = loop.call_at((self.current + 1) * self.tick, self._advance)
+
+        deadline = max(math.ceil((loop.time() + timeout) / self.tick), self.current + 1)
+        self.deadlines[key] = deadline
+        self.slots[deadline % len(self.slots)].add(key)
+
+    def remove(self, key):
+        try:
+            deadline = self.deadlines.pop(key)
+        except KeyError:
+            return False
+
+        self.slots[deadline % len(self.slots)].discard(key)
+
+        return True
+
+    def _advance(self):
+        loop = asyncio.get_event_loop()
+        now = int(loop.time() / self.tick)
+        expired = []
+
+        for tick in range(self.current + 1, min(now, self.current + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            keys = [key for key in slot if self.deadlines[key] <= now]
+
+            for key in keys:
+                slot.discard(key)
+                self.deadlines.pop(key)
+
+            expired.extend(keys)
+
+        self.current = max(now, self.current)
+
+        if self.deadlines:
+            self.timer = loop.call_at((self.current + 1) * self.tick, self._advance)
+        else:
+            self.timer = None
+
+        if expired:
+            self.on_expire(expired)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import socket
+import logging
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+COLLECTOR_SCHEME = 'udp://'
+# Trace of the request or event that is handled in the current task, continued by the messages it sends
+current_trace = contextvars.ContextVar('trace', default=None)
+
+
+def new_trace_id():
+    return os.urandom(8).hex()
+
+
+class Tracer:
+    """
+    Records the spans of traced messages in one service. Span times are unix timestamps to line up the spans of
+    all processes on a host
+    """
+
+    def __init__(self, service, exporter):
+        self.service = service
+        self.exporter = exporter
+        self.spans = 0
+
+    def span(self, trace, name, start, end=None, **attributes):
+        end = end if end is not None else time.time()
+        self.spans += 1
+        self.exporter.export({'trace': trace, 'service': self.service, 'name': name, 'start': start, 'end': end,
+                              'duration-ms': round((end - start) * 1000, 3), **attributes})
+
+    def close(self):
+        self.exporter.close()
+
+    def __repr__(self):
+        return f"Tracer(service: {self.service}, exporter: {self.exporter}, spans: {self.spans})"
+
+
+class FileExporter:
+    """
+    Appends spans as JSON lines to a file. Each span is a single write, so several processes can share the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def export(self, span):
+        try:
+            os.write(self.fd, (json.dumps(span) + '\n').encode())
+        except OSError as error:
+            logger.debug(f"Can't write span to {self.path}. {error.strerror}")
+
+    def close(self):
+        os.close(self.fd)
+
+    def __repr__(self):
+        return f"FileExporter(path: {self.path})"
+
+
+class CollectorExporter:
+    """
+    Sends each span as JSON datagram to a collector. A missing collector doesn't block or fail the service
+    """
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def export(self, span):
+        try:
+            self.socket.sendto(json.dumps(span).encode(), self.address)
+        except OSError as error:
+            logger.debug(f"Can't send span to {self.address}. {error.strerror}")
+
+    def close(self):
+        self.socket.close()
+
+    def __repr__(self):
+        return f"CollectorExporter(address: {self.address})"
+
+
+def exporter(target):
+    """
+    Exporter for a file path or a collector address udp://HOST:PORT
+    """
+    if target.startswith(COLLECTOR_SCHEME):
+        host, _, port = target[len(COLLECTOR_SCHEME):].rpartition(':')
+
+        return CollectorExporter(host, int(port))
+
+    return FileExporter(target)
+
+
+def tracer(service, target):
+    """
+    Tracer of a service exporting to target, None without target
+    """
+    return Tracer(service, exporter(target)) if target else None
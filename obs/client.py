@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
 import signal
 import asyncio
 import logging
 import websockets
-from misc import exceptions, baseclient, message as msg
+from misc import exceptions, baseclient, codec, tracing, loopback, message as msg
+from misc.message_log import MessageLog
 
 APPLICATION_NAME = 'OBS Studio'
 DEFAULTHOST = 'localhost'
 DEFAULTPORT_MIDDLEWARE = 4445
 DEFAULTPORT_OBS = 4444
+# update-type: state slot. The heart sends the last event of each slot to new subscribers
+LAST_VALUES = {'SwitchScenes': 'scene', 'StreamStarted': 'streaming', 'StreamStopped': 'streaming'}
 
 logger = logging.getLogger(__name__)
 middleware_host = DEFAULTHOST
@@ -20,10 +24,52 @@ obs_port = DEFAULTPORT_OBS
 
 
 class OBSClient(baseclient.Client):
-    def __init__(self, name, wsserver_address, obsserver_address, registration=None, subscriptions=None, ssl_cert=None):
-        super().__init__(name, wsserver_address, registration, subscriptions, ssl_cert)
+    # Message-id of the streaming status the bridge requests from OBS after connecting
+    STATE_REQUEST_ID = 'bridge-streaming-state'
+
+    def __init__(self, name, wsserver_address, obsserver_address, registration=None, subscriptions=None, ssl_cert=None,
+                 trace_sample=MessageLog.SAMPLE_RATE, tracer=None, last_values=None):
+        super().__init__(name, wsserver_address, registration, subscriptions, ssl_cert, trace_sample=trace_sample,
+                         tracer=tracer, last_values=last_values)
         self.obsserver_address = obsserver_address
         self.websocket_obs = None
+        self.obs_requests = None
+        # message-id: (trace, sent) of traced requests waiting for OBS
+        self.traced = {}
+        self.state_pending = False
+
+    async def _loopback_connect(self):
+        try:
+            async with websockets.connect(
+                    f'ws://{self.obsserver_address[0]}:{self.obsserver_address[1]}') as self.websocket_obs:
+                logger.debug(f"{self.name} connected to {self.websocket_obs.remote_address}")
+                async with loopback.connect(self.wsserver_address) as self.websocket:
+                    await self._handle()
+        except ConnectionRefusedError as error:
+            logger.debug(f"{error.strerror}")
+        except asyncio.CancelledError:
+            await self._close()
+            return False
+
+        return True
+
+    async def _unix_connect(self):
+        try:
+            async with websockets.connect(
+                    f'ws://{self.obsserver_address[0]}:{self.obsserver_address[1]}') as self.websocket_obs:
+                logger.debug(f"{self.name} connected to {self.websocket_obs.remote_address}")
+                async with websockets.unix_connect(
+                        baseclient.unix_path(self.wsserver_address), subprotocols=codec.SUBPROTOCOLS,
+                        ping_interval=self.ping_interval, ping_timeout=self.ping_timeout,
+                        close_timeout=self.CLOSE_TIMEOUT) as self.websocket:
+                    await self._handle()
+        except (ConnectionRefusedError, FileNotFoundError) as error:
+            logger.debug(f"{error.strerror}")
+        except asyncio.CancelledError:
+            await self._close()
+            return False
+
+        return True
 
     async def _ssl_connect(self):
         try:
@@ -32,7 +78,8 @@ class OBSClient(baseclient.Client):
                 logger.debug(f"{self.name} connected to {self.websocket_obs.remote_address}")
                 async with websockets.connect(
                         f'wss://{self.wsserver_address[0]}:{self.wsserver_address[1]}',
-                        ssl=self.ssl_context) as self.websocket:
+                        ssl=self.ssl_context, subprotocols=codec.SUBPROTOCOLS, ping_interval=self.ping_interval,
+                        ping_timeout=self.ping_timeout, close_timeout=self.CLOSE_TIMEOUT) as self.websocket:
                     await self._handle()
         except ConnectionRefusedError as error:
             logger.debug(f"{error.strerror}")
@@ -48,7 +95,9 @@ class OBSClient(baseclient.Client):
                     f'ws://{self.obsserver_address[0]}:{self.obsserver_address[1]}') as self.websocket_obs:
                 logger.debug(f"{self.name} connected to {self.websocket_obs.remote_address}")
                 async with websockets.connect(
-                        f'ws://{self.wsserver_address[0]}:{self.wsserver_address[1]}') as self.websocket:
+                        f'ws://{self.wsserver_address[0]}:{self.wsserver_address[1]}',
+                        subprotocols=codec.SUBPROTOCOLS, ping_interval=self.ping_interval,
+                        ping_timeout=self.ping_timeout, close_timeout=self.CLOSE_TIMEOUT) as self.websocket:
                     await self._handle()
         except ConnectionRefusedError as error:
             logger.debug(f"{error.strerror}")
@@ -60,6 +109,7 @@ class OBSClient(baseclient.Client):
 
     async def _handle(self):
         logger.debug(f"{self.name} connected to {self.websocket.remote_address}")
+        self.codec = codec.get_codec(self.websocket.subprotocol)
         self.reconnect_counter = 0
         self.backoff.reset()
         consumer_task = asyncio.create_task(self.consumer())
@@ -82,9 +132,17 @@ class OBSClient(baseclient.Client):
             logger.error(error)
             return False
 
+        self.obs_requests = asyncio.Queue()
+        self.traced.clear()
+        # OBS only sends stream events on a change, the current state is sent as event for the heart to replay
+        self.state_pending = True
+        self.obs_requests.put_nowait((msg.Request(APPLICATION_NAME, 'GetStreamingStatus', OBSClient.STATE_REQUEST_ID),
+                                      None, None))
+        self.ready.set()
         obs_task = asyncio.create_task(self.consumer_obs())
         middleware_task = asyncio.create_task(self.consumer_middleware())
-        done, pending = await asyncio.wait([obs_task, middleware_task],
+        producer_task = asyncio.create_task(self.producer_obs())
+        done, pending = await asyncio.wait([obs_task, middleware_task, producer_task],
                                            return_when=asyncio.FIRST_COMPLETED)
 
         [future.cancel() for future in pending]
@@ -99,46 +157,115 @@ class OBSClient(baseclient.Client):
         await self.websocket.close()
 
     async def consumer_middleware(self):
+        """
+        Reads requests from the heart without waiting for OBS. The receive time is kept to drop requests whose
+        deadline expired while they were queued for OBS and for the span of traced requests
+        """
         try:
             async for message in self.websocket:
-                logger.debug(f"From heart: {message}")
+                start = self.message_log.start()
+
                 try:
-                    request = msg.Request(message=message)
-
-                    if type(request) is msg.Request:
-                        json_msg = json.dumps(
-                            {**{msg.REQUEST_FIELDS[1]: request.request_type, msg.REQUEST_FIELDS[2]: str(request.id)},
-                             **request.additionals})
-                        await self.websocket_obs.send(json_msg)
-                except exceptions.InvalidRequestError as error:
+                    request = msg.Request(message=self.codec.decode(message))
+                    deadline = request.additionals.pop(msg.DEADLINE_FIELD, None)
+                    trace = request.additionals.pop(msg.TRACE_FIELD, None)
+                    trace = (trace, time.time()) if trace and self.tracer else None
+
+                    if type(deadline) in (int, float):
+                        self.obs_requests.put_nowait((request, time.monotonic() + deadline, trace))
+                    else:
+                        self.obs_requests.put_nowait((request, None, trace))
+
+                    if start is not None:
+                        self.message_log.log(start, 'from-heart', client=self.name, size=len(message),
+                                             message=message)
+                except exceptions.MessageError as error:
                     logger.debug(f"{error}, message-id: {error.message_id}")
-                except websockets.ConnectionClosedOK:
-                    logger.debug(f"heart sent message to closed obs connection")
         except websockets.ConnectionClosed as error:
             logger.debug(
                 f"Connection canceled from {self.wsserver_address} "
                 f"({error.code}, reason: {error.reason if error.reason else 'unknown'})")
 
+    async def producer_obs(self):
+        while True:
+            request, deadline, trace = await self.obs_requests.get()
+
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.debug(f"Request {request.request_type} dropped. Deadline expired (message-id: {request.id})")
+                continue
+
+            json_msg = json.dumps(
+                {**{msg.REQUEST_FIELDS[1]: request.request_type, msg.REQUEST_FIELDS[2]: str(request.id)},
+                 **request.additionals})
+
+            try:
+                await self.websocket_obs.send(json_msg)
+            except websockets.ConnectionClosedOK:
+                logger.debug(f"heart sent message to closed obs connection")
+                return
+
+            if trace:
+                self.tracer.span(trace[0], 'bridge', trace[1], **{'request-type': request.request_type,
+                                                                   'message-id': request.id})
+                self.traced[request.id] = (trace[0], time.time())
+
     async def consumer_obs(self, only_connection_check=False):
         try:
             async for message in self.websocket_obs:
                 if only_connection_check:
                     continue
 
-                logger.debug(f"From obs: {message}")
+                start = self.message_log.start()
+
+                if self.traced:
+                    self._obs_span(message)
+
+                if self.state_pending and OBSClient.STATE_REQUEST_ID in message and await self._send_state(message):
+                    continue
 
                 try:
-                    await self.send(message)
+                    await self.send(msg.decode(message) if self.codec.binary else message)
                 except websockets.ConnectionClosedOK:
                     logger.debug("obs sent message to closed heart connection")
+
+                if start is not None:
+                    self.message_log.log(start, 'from-obs', client=self.name, size=len(message), message=message)
         except websockets.ConnectionClosed as error:
             logger.debug(
                 f"Connection canceled from {self.obsserver_address} "
                 f"({error.code}, reason: {error.reason if error.reason else 'unknown'})")
 
+    async def _send_state(self, message):
+        """
+        Streaming status requested by the bridge, sent to the heart as StreamStarted or StreamStopped.
+        Returns False for any other message
+        """
+        response = msg.decode(message)
+
+        if response.get(msg.RESPONSE_FIELDS[0]) != OBSClient.STATE_REQUEST_ID:
+            return False
+
+        self.state_pending = False
+        update_type = 'StreamStarted' if response.get('streaming') else 'StreamStopped'
+        await self.send(msg.Event(update_type, **{msg.REPLAY_FIELD: True}))
+
+        return True
+
+    def _obs_span(self, message):
+        """
+        Span of a traced request from sending it to OBS until its response
+        """
+        header = msg.peek_header(message)
+
+        if header and header.kind is msg.Response:
+            trace = self.traced.pop(header.id, None)
+
+            if trace:
+                self.tracer.span(trace[0], 'obs', trace[1], status=header.status, **{'message-id': header.id})
+
 
 async def start(host_mw=DEFAULTHOST, port_mw=DEFAULTPORT_MIDDLEWARE, host_obs=DEFAULTHOST, port_obs=DEFAULTPORT_OBS,
-                ssl_cert=None):
+                ssl_cert=None, trace_sample=MessageLog.SAMPLE_RATE, trace_export=None):
     global middleware_host, middleware_port, obs_host, obs_port
 
     middleware_host, middleware_port = host_mw if host_mw else DEFAULTHOST, port_mw if port_mw else \
@@ -147,7 +274,8 @@ async def start(host_mw=DEFAULTHOST, port_mw=DEFAULTPORT_MIDDLEWARE, host_obs=DE
 
     registration = APPLICATION_NAME
     obsclient = OBSClient('obsclient', (middleware_host, middleware_port),
-                          (obs_host, obs_port), registration, ssl_cert=ssl_cert)
+                          (obs_host, obs_port), registration, ssl_cert=ssl_cert, trace_sample=trace_sample,
+                          tracer=tracing.tracer(APPLICATION_NAME, trace_export), last_values=LAST_VALUES)
 
     task = asyncio.create_task(obsclient.connect())
     loop = asyncio.get_event_loop()
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import websockets
+
+DEFAULTHOST = 'localhost'
+DEFAULTPORT = 4444
+SCENES = ('Start', 'Live', 'BRB', 'End')
+SOURCES = ('Camera', 'Overlay', 'Bad connection')
+
+logger = logging.getLogger(__name__)
+
+
+class MockOBS:
+    """
+    Stand-in for OBS Studio with obs-websocket 4.x. Answers the requests used by Streamheart and sends the
+    matching events. Requests of a connection are processed in order after an artificial latency like OBS does
+    on its main thread. StreamStatus events are sent at event_rate while streaming
+    """
+
+    def __init__(self, host=DEFAULTHOST, port=DEFAULTPORT, latency=0, jitter=0, event_rate=0, scenes=SCENES,
+                 sources=SOURCES):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.event_rate = event_rate
+        self.scenes = {name: [{'id': index, 'name': source, 'type': 'input', 'visible': True}
+                              for index, source in enumerate(sources)] for name in scenes}
+        self.current_scene = scenes[0]
+        self.scene_collection = 'Streamheart'
+        self.streaming = False
+        self.stream_started = None
+        self.clients = set()
+        self.server = None
+        self.status_task = None
+        self.requests = 0
+        # Called with the request after it's processed, e.g. to measure latencies
+        self.on_request = None
+
+    async def start(self):
+        self.server = await websockets.serve(self._handler, self.host, self.port)
+
+        if self.event_rate:
+            self.status_task = asyncio.create_task(self._stream_status())
+
+        logger.debug(f"Mock OBS started on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.status_task:
+            self.status_task.cancel()
+
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handler(self, websocket, path):
+        self.clients.add(websocket)
+
+        try:
+            async for message in websocket:
+                await self._delay()
+                await self._process(websocket, message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.clients.discard(websocket)
+
+    async def _delay(self):
+        delay = self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _process(self, websocket, message):
+        try:
+            request = json.loads(message)
+            message_id = request['message-id']
+            request_type = request['request-type']
+        except (ValueError, TypeError, KeyError):
+            await websocket.send(json.dumps({'status': 'error', 'error': 'invalid JSON payload'}))
+            return
+
+        self.requests += 1
+
+        try:
+            response, events = REQUESTS.get(request_type, invalid_request_type)(self, request)
+            response = {'message-id': message_id, 'status': 'ok', **response}
+        except RequestError as error:
+            response, events = {'message-id': message_id, 'status': 'error', 'error': str(error)}, []
+
+        if self.on_request:
+            self.on_request(request)
+
+        await websocket.send(json.dumps(response))
+
+        for event in events:
+            self.broadcast(event)
+
+    def broadcast(self, event):
+        message = json.dumps(event)
+
+        for client in self.clients:
+            asyncio.create_task(client.send(message))
+
+    async def _stream_status(self):
+        while True:
+            await asyncio.sleep(1 / self.event_rate)
+
+            if self.streaming:
+                self.broadcast({'update-type': 'StreamStatus', 'streaming': True, 'recording': False,
+                                'kbits-per-sec': random.randint(2500, 6000), 'fps': 30, 'strain': 0,
+                                'total-stream-time': int(time.monotonic() - self.stream_started)})
+
+    def scene(self, name):
+        try:
+            return {'name': name, 'sources': self.scenes[name]}
+        except KeyError:
+            raise RequestError('requested scene does not exist')
+
+    def scene_item(self, request):
+        item = request.get('item')
+        name = item.get('name') if isinstance(item, dict) else item
+        scene = self.scene(request.get('scene-name', self.current_scene))
+
+        for source in scene['sources']:
+            if source['name'] == name:
+                return scene['name'], source
+
+        raise RequestError('specified scene item doesn\'t exist')
+
+
+class RequestError(Exception):
+    """
+    Error status of an obs-websocket response
+    """
+
+
+def invalid_request_type(obs, request):
+    raise RequestError('invalid request type')
+
+
+def get_version(obs, request):
+    return {'version': 1.1, 'obs-websocket-version': '4.9.1', 'obs-studio-version': '27.0.0',
+            'available-requests': ','.join(REQUESTS)}, []
+
+
+def get_auth_required(obs, request):
+    return {'authRequired': False}, []
+
+
+def get_scene_list(obs, request):
+    return {'current-scene': obs.current_scene, 'scenes': [obs.scene(name) for name in obs.scenes]}, []
+
+
+def get_current_scene(obs, request):
+    return obs.scene(obs.current_scene), []
+
+
+def set_current_scene(obs, request):
+    scene = obs.scene(request.get('scene-name'))
+    obs.current_scene = scene['name']
+
+    return {}, [{'update-type': 'SwitchScenes', 'scene-name': scene['name'], 'sources': scene['sources']}]
+
+
+def get_scene_item_properties(obs, request):
+    _, source = obs.scene_item(request)
+
+    return {'itemId': source['id'], 'name': source['name'], 'visible': source['visible']}, []
+
+
+def set_scene_item_properties(obs, request):
+    scene_name, source = obs.scene_item(request)
+
+    if 'visible' not in request or source['visible'] == request['visible']:
+        return {}, []
+
+    source['visible'] = request['visible']
+
+    return {}, [{'update-type': 'SceneItemVisibilityChanged', 'scene-name': scene_name,
+                 'item-name': source['name'], 'item-id': source['id'], 'item-visible': source['visible']}]
+
+
+def set_current_scene_collection(obs, request):
+    obs.scene_collection = request.get('sc-name', obs.scene_collection)
+
+    return {}, [{'update-type': 'SceneCollectionChanged', 'sceneCollection': obs.scene_collection}]
+
+
+def get_streaming_status(obs, request):
+    return {'streaming': obs.streaming, 'recording': False, 'recording-paused': False, 'virtualcam': False,
+            'preview-only': False}, []
+
+
+def start_streaming(obs, request):
+    if obs.streaming:
+        raise RequestError('streaming already active')
+
+    obs.streaming = True
+    obs.stream_started = time.monotonic()
+
+    return {}, [{'update-type': 'StreamStarting', 'preview-only': False}, {'update-type': 'StreamStarted'}]
+
+
+def stop_streaming(obs, request):
+    if not obs.streaming:
+        raise RequestError('streaming not active')
+
+    obs.streaming = False
+
+    return {}, [{'update-type': 'StreamStopping', 'preview-only': False}, {'update-type': 'StreamStopped'}]
+
+
+def start_stop_streaming(obs, request):
+    return stop_streaming(obs, request) if obs.streaming else start_streaming(obs, request)
+
+
+def take_source_screenshot(obs, request):
+    return {'sourceName': request.get('sourceName', obs.current_scene), 'img': '',
+            'imageFile': request.get('saveToFilePath', '')}, []
+
+
+REQUESTS = {
+    'GetVersion': get_version,
+    'GetAuthRequired': get_auth_required,
+    'GetSceneList': get_scene_list,
+    'GetCurrentScene': get_current_scene,
+    'SetCurrentScene': set_current_scene,
+    'GetSceneItemProperties': get_scene_item_properties,
+    'SetSceneItemProperties': set_scene_item_properties,
+    'SetCurrentSceneCollection': set_current_scene_collection,
+    'GetStreamingStatus': get_streaming_status,
+    'StartStreaming': start_streaming,
+    'StopStreaming': stop_streaming,
+    'StartStopStreaming': start_stop_streaming,
+    'TakeSourceScreenshot': take_source_screenshot,
+}
+
+
+async def run(args):
+    obs = MockOBS(args.host, args.port, args.latency / 1000, args.jitter / 1000, args.event_rate)
+    await obs.start()
+    await asyncio.Future()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OBS Studio with obs-websocket 4.x for tests without OBS')
+    parser.add_argument('--host', default=DEFAULTHOST, help='Host address')
+    parser.add_argument('--port', type=int, default=DEFAULTPORT, help='Port')
+    parser.add_argument('--latency', type=float, default=0, help='Processing time of a request in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='Random additional processing time in ms')
+    parser.add_argument('--event-rate', type=float, default=0, help='StreamStatus events per second while streaming')
+    parser.add_argument('-d', '--debug', action='store_true', help='Debug mode')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
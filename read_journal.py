@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import argparse
+from datetime import datetime
+from heart import journal
+
+
+def timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def show(record):
+    time = datetime.fromtimestamp(record.timestamp).isoformat(sep=' ', timespec='milliseconds')
+
+    if isinstance(record.frame, str):
+        frame = record.frame
+    else:
+        message = journal.decode(record)
+        frame = json.dumps(message) if message is not None else record.frame.hex()
+
+    print(f"{time}  {record.clientid:>5}  {record.application or '-':<16}  {frame}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the messages recorded in the event journal of the middleware')
+    parser.add_argument('journal', help='Path of the event journal')
+    parser.add_argument('--start', type=timestamp, help='Start time (ISO 8601 or unix timestamp)')
+    parser.add_argument('--end', type=timestamp, help='End time (ISO 8601 or unix timestamp)')
+    parser.add_argument('-a', '--application', help='Messages from or requests to this application')
+    args = parser.parse_args()
+
+    for entry in journal.JournalReader(args.journal).records(args.start, args.end, args.application):
+        show(entry)
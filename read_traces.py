@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import argparse
+from datetime import datetime
+from collections import defaultdict
+
+ATTRIBUTES = ('command', 'application', 'request-type', 'update-type', 'handler', 'status')
+
+
+def read(path):
+    traces = defaultdict(list)
+
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                span = json.loads(line)
+                traces[span['trace']].append(span)
+            except (json.JSONDecodeError, KeyError):
+                continue
+
+    return traces
+
+
+def show(trace, spans):
+    spans.sort(key=lambda span: span['start'])
+    begin = spans[0]['start']
+    duration = (max(span['end'] for span in spans) - begin) * 1000
+    time = datetime.fromtimestamp(begin).isoformat(sep=' ', timespec='milliseconds')
+
+    print(f"{trace}  {time}  {duration:.3f} ms")
+
+    for span in spans:
+        attributes = ' '.join(f'{key}={span[key]}' for key in ATTRIBUTES if key in span)
+        print(f"  +{(span['start'] - begin) * 1000:>9.3f} ms {span['duration-ms']:>9.3f} ms  "
+              f"{span['service']:<12}  {span['name']:<15}  {attributes}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the spans of traced messages per trace')
+    parser.add_argument('spans', help='Path of the span file')
+    parser.add_argument('-t', '--trace', help='Only this trace ID')
+    parser.add_argument('--min-ms', type=float, default=0, help='Only traces that took at least this long')
+    args = parser.parse_args()
+
+    for trace_id, trace_spans in read(args.spans).items():
+        if args.trace and trace_id != args.trace:
+            continue
+
+        if (max(span['end'] for span in trace_spans) - min(span['start'] for span in trace_spans)) * 1000 < \
+                args.min_ms:
+            continue
+
+        show(trace_id, trace_spans)
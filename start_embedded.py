@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import argparse
+from misc import starter
+from heart.server import Server, DEFAULTPORT
+from start_middleware import CACHE_TTLS, CACHE_INVALIDATIONS
+
+logger = logging.getLogger(__name__)
+APPS = ('heart_rate', 'obs', 'twitch_bot')
+DEFAULT_APPS = ['heart_rate', 'obs']
+# Apps connect through the loopback listener of the heart, the host isn't used
+APP_HOST = '127.0.0.1'
+
+
+def app_name(value):
+    if value not in APPS:
+        raise argparse.ArgumentTypeError(f"invalid app: {value} (choose from {', '.join(APPS)})")
+
+    return value
+
+
+def start_app(name):
+    """
+    Start coroutine of an app. Apps are imported on demand, twitch_bot needs the irc package
+    """
+    if name == 'heart_rate':
+        from heart_rate import heart_rate
+
+        return heart_rate.start(args.config, APP_HOST, args.port)
+
+    if name == 'obs':
+        from obs import client
+
+        return client.start(APP_HOST, args.port, args.host_obs, args.port_obs, trace_export=args.trace_export)
+
+    from twitch_bot import bot
+
+    return bot.start(args.config, args.bot_config, APP_HOST, args.port, trace_export=args.trace_export)
+
+
+async def run():
+    server = Server(args.host, args.port, (args.cert, args.key), cache_ttls=CACHE_TTLS,
+                    cache_invalidations=CACHE_INVALIDATIONS, trace_export=args.trace_export, loopback=True)
+    server_task = asyncio.create_task(server.start())
+
+    while not server.websocket and not server_task.done():
+        await asyncio.sleep(0.01)
+
+    apps = {asyncio.create_task(start_app(name)): name for name in args.apps}
+    done, _ = await asyncio.wait([server_task, *apps], return_when=asyncio.FIRST_COMPLETED)
+
+    # Every app and the heart install their own signal handlers and the loop keeps only the last one.
+    # Whichever part stops first, the others are stopped with it
+    for task in done:
+        logger.info(f"{apps.get(task, 'heart')} stopped")
+
+    if not server_task.done():
+        server.stop_server()
+
+    [task.cancel() for task in apps]
+    await asyncio.gather(server_task, *apps, return_exceptions=True)
+
+
+def start():
+    asyncio.run(run(), debug=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Middleware and apps in one process. The apps talk to the '
+                                                 'middleware in memory, remote clients connect over websockets')
+    # Not choices, argparse checks the empty list of nargs='*' against them
+    parser.add_argument('apps', nargs='*', type=app_name, metavar='APP',
+                        help=f"Apps to run with the middleware ({', '.join(APPS)}). "
+                             f"Default: {' '.join(DEFAULT_APPS)}")
+    parser.add_argument('--host', help='Middleware host address for remote clients')
+    parser.add_argument('--port', type=int, default=DEFAULTPORT, help='Middleware port')
+    parser.add_argument('--cert', help='Path to certificate file')
+    parser.add_argument('--key', help='Path to key file for corresponding certificate')
+    parser.add_argument('--config', help='Streamheart config path')
+    parser.add_argument('--bot_config', help='Bot config path')
+    parser.add_argument('--host_obs', help='OBS Studio host address')
+    parser.add_argument('--port_obs', type=int, help='OBS Studio port')
+    parser.add_argument('--trace-export', help='Write the spans of traced messages to this file or udp://HOST:PORT')
+    parser.add_argument('-s', '--signal', choices=['stop'], help='Shut down gracefully')
+    parser.add_argument('-d', '--debug', action='store_true', help='Debug mode')
+    args = parser.parse_args()
+    args.apps = args.apps if args.apps else DEFAULT_APPS
+
+    starter.run('embedded', start, parser)
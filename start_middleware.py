@@ -4,18 +4,92 @@
 import asyncio
 import argparse
 from misc import starter
-from heart.server import Server
+from heart.server import Server, METRICS_PATH
+from heart.cache import ResponseCache
+from heart.outbound import OutboundQueue
+from heart.journal import Journal
+from heart.admission import AdmissionControl
+from heart.liveness import Liveness
+from misc.message_log import MessageLog
+from misc.loop_monitor import LoopMonitor
+
+# (application, request-type): seconds a response is answered from the heart's cache
+CACHE_TTLS = {
+    ('OBS Studio', 'GetSceneList'): 10,
+    ('OBS Studio', 'GetCurrentScene'): 10,
+    ('OBS Studio', 'GetStreamingStatus'): 2,
+    ('Heartrate', 'GetBrbStatus'): 30,
+    ('Heartrate', 'GetBitrate'): 1,
+}
+# (application, update-type): request-types whose cached responses are invalidated by the event
+CACHE_INVALIDATIONS = {
+    ('OBS Studio', 'SwitchScenes'): ('GetSceneList', 'GetCurrentScene'),
+    ('OBS Studio', 'ScenesChanged'): ('GetSceneList', 'GetCurrentScene'),
+    ('OBS Studio', 'SceneCollectionChanged'): ('GetSceneList', 'GetCurrentScene'),
+    ('OBS Studio', 'StreamStarting'): ('GetStreamingStatus',),
+    ('OBS Studio', 'StreamStarted'): ('GetStreamingStatus',),
+    ('OBS Studio', 'StreamStopping'): ('GetStreamingStatus',),
+    ('OBS Studio', 'StreamStopped'): ('GetStreamingStatus',),
+    ('OBS Studio', 'RecordingStarted'): ('GetStreamingStatus',),
+    ('OBS Studio', 'RecordingStopped'): ('GetStreamingStatus',),
+    ('Heartrate', 'BrbEnabled'): ('GetBrbStatus',),
+    ('Heartrate', 'BrbDisabled'): ('GetBrbStatus',),
+    ('Heartrate', 'StatusChanged'): ('GetBitrate',),
+}
+
+
+def application_limit(value):
+    try:
+        name, limit = value.rsplit('=', 1)
+        rate, _, burst = limit.partition(':')
+
+        return name, (float(rate), float(burst) if burst else 2 * float(rate))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not NAME=RATE[:BURST]")
+
+
+def seconds(value):
+    try:
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a number")
+
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"{value} is negative")
+
+    return value
+
+
+def positive_seconds(value):
+    value = seconds(value)
+
+    if not value:
+        raise argparse.ArgumentTypeError(f"{value} is not positive")
+
+    return value
 
 
 def start():
+    application_limits = dict(AdmissionControl.APPLICATION_LIMITS)
+    application_limits.update(args.application_limit)
+    admission = AdmissionControl(args.client_rate, args.client_burst, args.max_in_flight, application_limits)
+    options = {'header_forwarding': not args.full_decode, 'queue_size': args.queue_size,
+               'overflow_limit': args.overflow_limit, 'response_cache': not args.no_cache, 'cache_ttls': CACHE_TTLS,
+               'cache_invalidations': CACHE_INVALIDATIONS, 'cache_size': args.cache_size,
+               'metrics_path': args.metrics_path if args.metrics_path else None, 'journal': args.journal,
+               'journal_size': args.journal_size * 1024 * 1024, 'admission': admission,
+               'heartbeat_interval': args.heartbeat_interval, 'heartbeat_timeout': args.heartbeat_timeout,
+               'trace_sample': args.trace_sample, 'trace_export': args.trace_export, 'unix_path': args.unix_socket,
+               'lag_interval': args.lag_interval, 'slow_handler': args.slow_handler / 1000}
+
     if args.host:
-        server = Server(args.host, ssl_cert=(args.cert, args.key))
+        server = Server(args.host, ssl_cert=(args.cert, args.key), **options)
     elif args.port:
-        server = Server(port=args.port, ssl_cert=(args.cert, args.key))
+        server = Server(port=args.port, ssl_cert=(args.cert, args.key), **options)
     elif args.host and args.port:
-        server = Server(args.host, args.port, (args.cert, args.key))
+        server = Server(args.host, args.port, (args.cert, args.key), **options)
     else:
-        server = Server(ssl_cert=(args.cert, args.key))
+        server = Server(ssl_cert=(args.cert, args.key), **options)
 
     asyncio.run(server.start(), debug=False)
 
@@ -24,8 +98,44 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Middleware websocket for message exchange between applications')
     parser.add_argument('--host', help='Host address')
     parser.add_argument('--port', type=int, help='Port')
+    parser.add_argument('--unix-socket', help='Path of an additional Unix socket for apps on this host. '
+                                              'They connect with host unix:PATH')
     parser.add_argument('--cert', help='Path to certificate file')
     parser.add_argument('--key', help='Path to key file for corresponding certificate')
+    parser.add_argument('--full-decode', action='store_true',
+                        help='Decode forwarded requests and responses completely instead of header-only')
+    parser.add_argument('--queue-size', type=int, default=OutboundQueue.MAX_SIZE,
+                        help='Queued events per connection before the oldest is dropped')
+    parser.add_argument('--overflow-limit', type=int, default=OutboundQueue.OVERFLOW_LIMIT,
+                        help='Dropped or excess messages before a slow connection is closed')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the response cache for idempotent requests')
+    parser.add_argument('--cache-size', type=int, default=ResponseCache.MAX_ENTRIES,
+                        help='Cached responses per request-type')
+    parser.add_argument('--metrics-path', nargs='?', const=METRICS_PATH,
+                        help=f'Serve the Prometheus metrics on the middleware port under this HTTP path (default: '
+                             f'{METRICS_PATH}). They are served without authentication, disabled if not given')
+    parser.add_argument('--journal', help='Path of the event journal. Records all received messages in a ring buffer')
+    parser.add_argument('--journal-size', type=int, default=Journal.SIZE // (1024 * 1024),
+                        help='Size of the event journal in MB')
+    parser.add_argument('--client-rate', type=float, default=AdmissionControl.CLIENT_RATE,
+                        help='Requests per second of a client. 0 to disable')
+    parser.add_argument('--client-burst', type=float, default=AdmissionControl.CLIENT_BURST,
+                        help='Request burst of a client')
+    parser.add_argument('--max-in-flight', type=int, default=AdmissionControl.MAX_IN_FLIGHT,
+                        help='Requests of a client waiting for a response. 0 to disable')
+    parser.add_argument('--application-limit', type=application_limit, action='append', default=[],
+                        metavar='NAME=RATE[:BURST]', help='Requests per second to an application. 0 to disable')
+    parser.add_argument('--heartbeat-interval', type=seconds, default=Liveness.INTERVAL,
+                        help='Seconds without message until a client is pinged. 0 to disable')
+    parser.add_argument('--heartbeat-timeout', type=positive_seconds, default=Liveness.TIMEOUT,
+                        help='Seconds without pong after the interval until a client is disconnected')
+    parser.add_argument('--trace-sample', type=int, default=MessageLog.SAMPLE_RATE,
+                        help='Log every Nth message with its handling time. 0 to disable')
+    parser.add_argument('--trace-export', help='Write the spans of traced messages to this file or udp://HOST:PORT')
+    parser.add_argument('--lag-interval', type=float, default=LoopMonitor.INTERVAL,
+                        help='Seconds between event loop lag samples. 0 to disable the loop monitor')
+    parser.add_argument('--slow-handler', type=float, default=LoopMonitor.THRESHOLD * 1000,
+                        help='Milliseconds a handler may block the event loop before it is logged as slow')
     parser.add_argument('-s', '--signal', choices=['stop'], help='Shut down gracefully')
     parser.add_argument('-d', '--debug', action='store_true', help='Debug mode')
     args = parser.parse_args()
@@ -5,11 +5,13 @@ import asyncio
 import argparse
 from obs import client
 from misc import starter
+from misc.message_log import MessageLog
 
 
 def start():
     asyncio.run(
-        client.start(args.host_middleware, args.port_middleware, args.host_obs, args.port_obs, args.cert),
+        client.start(args.host_middleware, args.port_middleware, args.host_obs, args.port_obs, args.cert,
+                     args.trace_sample, args.trace_export),
         debug=False)
 
 
@@ -20,6 +22,9 @@ if __name__ == '__main__':
     parser.add_argument('--host_obs', help='OBS Studio host address')
     parser.add_argument('--port_obs', type=int, help='OBS Studio port')
     parser.add_argument('--cert', help='Path to certificate file')
+    parser.add_argument('--trace-sample', type=int, default=MessageLog.SAMPLE_RATE,
+                        help='Log every Nth message with its handling time. 0 to disable')
+    parser.add_argument('--trace-export', help='Write the spans of traced messages to this file or udp://HOST:PORT')
     parser.add_argument('-s', '--signal', choices=['stop'], help='Shut down gracefully')
     parser.add_argument('-d', '--debug', action='store_true', help='Debug mode')
     args = parser.parse_args()
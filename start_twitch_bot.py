@@ -8,7 +8,8 @@ from twitch_bot import bot
 
 
 def start():
-    asyncio.run(bot.start(args.config, args.bot_config, args.host, args.port, args.cert), debug=False)
+    asyncio.run(bot.start(args.config, args.bot_config, args.host, args.port, args.cert,
+                          args.trace_export), debug=False)
 
 
 if __name__ == '__main__':
@@ -19,6 +20,7 @@ if __name__ == '__main__':
     parser.add_argument('--config', help='Streamheart config path')
     parser.add_argument('--bot_config', help='Bot config path')
     parser.add_argument('--cert', help='Path to certificate file')
+    parser.add_argument('--trace-export', help='Write the spans of traced messages to this file or udp://HOST:PORT')
     parser.add_argument('-s', '--signal', choices=['stop'], help='Shut down gracefully')
     parser.add_argument('-d', '--debug', action='store_true', help='Debug mode')
     args = parser.parse_args()
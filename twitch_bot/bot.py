@@ -8,7 +8,7 @@ from pathlib import Path
 from functools import partial
 from configparser import ConfigParser
 from twitch_bot import irc_bot
-from misc import baseclient, exceptions, message as msg
+from misc import baseclient, exceptions, tracing, message as msg
 
 APPLICATION_NAME = 'TwitchBot'
 DEFAULT_HOST = '127.0.0.1'
@@ -209,12 +209,17 @@ async def event_switch_scenes(message, client, bot):
 
     scene = message.additionals['scene-name']
 
-    if scene != current_scene:
+    # A replayed event is the current scene after (re)subscribing, not a switch
+    if scene != current_scene and not message.additionals.get(msg.REPLAY_FIELD):
         bot.send(f"Szene wechselt zu {scene}")
-        current_scene = scene
+
+    current_scene = scene
 
 
 async def event_status_changed(message, client, bot):
+    if message.additionals.get(msg.REPLAY_FIELD):
+        return
+
     status = message.additionals['stream_status']
 
     if status == 'OFFLINE':
@@ -281,7 +286,7 @@ def load_streamheart_config():
 
 
 async def start(streamheart_config_path=DEFAULT_STREAMHEART_CONFIG_PATH, bot_config_path=DEFAULT_CONFIG_PATH,
-                host=DEFAULT_HOST, port=DEFAULT_PORT, ssl_cert=None):
+                host=DEFAULT_HOST, port=DEFAULT_PORT, ssl_cert=None, trace_export=None):
     global bot_config, streamheart_config, middleware_host, middleware_port
 
     streamheart_config = streamheart_config_path if streamheart_config_path else DEFAULT_STREAMHEART_CONFIG_PATH
@@ -294,13 +299,15 @@ async def start(streamheart_config_path=DEFAULT_STREAMHEART_CONFIG_PATH, bot_con
         return
 
     loop = asyncio.get_running_loop()
+    tracer = tracing.tracer(APPLICATION_NAME, trace_export)
 
     # Twitch chat bot
-    bot = irc_bot.Bot(bot_config, loop)
+    bot = irc_bot.Bot(bot_config, loop, tracer)
 
     # Websocket to heart
     subscriptions = ['OBS Studio', 'Heartrate']
-    client = baseclient.Client('twitch_bot', (DEFAULT_HOST, DEFAULT_PORT), APPLICATION_NAME, subscriptions, ssl_cert)
+    client = baseclient.Client('twitch_bot', (middleware_host, middleware_port), APPLICATION_NAME, subscriptions,
+                               ssl_cert, tracer=tracer)
     client.add_event('SwitchScenes', partial(event_switch_scenes, client=client, bot=bot))
     client.add_event('StatusChanged', partial(event_status_changed, client=client, bot=bot))
     client.add_event('CurrentPosition', partial(event_current_position, client=client, bot=bot))
@@ -333,10 +340,15 @@ async def start(streamheart_config_path=DEFAULT_STREAMHEART_CONFIG_PATH, bot_con
         [future.cancel() for future in pending]
         [future.exception() for future in done]
     except asyncio.CancelledError:
+        client_task.cancel()
+        bot.die()
         logger.debug(f"{client.name} stopped")
     except exceptions.ReconnectTimeout:
         logger.error(f"{client.name} reached maximum reconnects")
 
+    if tracer:
+        tracer.close()
+
 
 def stop(task, bot):
     task.cancel()
@@ -2,12 +2,14 @@
 
 import sys
 import json
+import time
 import asyncio
 import logging
 import irc.bot
 import irc.client
 import irc.client_aio
 from irc.dict import IRCDict
+from misc import tracing
 
 logger = logging.getLogger(__name__)
 IRC_SERVER = 'irc.chat.twitch.tv'
@@ -27,8 +29,9 @@ class User:
 
 
 class Bot(irc.bot.SingleServerIRCBot):
-    def __init__(self, config_path, loop):
+    def __init__(self, config_path, loop, tracer=None):
         self.loop = loop
+        self.tracer = tracer
         self.client_id = None
         self.token = None
         self.channel = None
@@ -129,10 +132,21 @@ class Bot(irc.bot.SingleServerIRCBot):
     def do_command(self, user, cmd):
         try:
             command = self.commands[cmd[0]]
-            asyncio.run_coroutine_threadsafe(command(args=cmd[1]), self.loop)
+            asyncio.run_coroutine_threadsafe(self._run_command(cmd[0], command, cmd[1], time.time()), self.loop)
         except KeyError:
             logger.debug(f"Unknown command !{cmd[0]}")
 
+    async def _run_command(self, name, command, args, received):
+        """
+        Runs a command on the event loop. With a tracer the command starts a trace with the hop from the IRC thread
+        """
+        if self.tracer:
+            trace = tracing.new_trace_id()
+            tracing.current_trace.set(trace)
+            self.tracer.span(trace, 'irc', received, command=name)
+
+        await command(args=args)
+
     def add_command(self, name, callback):
         self.commands[name] = callback
 
@@ -2,7 +2,6 @@ const websocket = new OBSWebSocket();
 
 let connected = false;
 let obs_finished = false;
-let streamheart_finished = false;
 let activeScene;
 
 websocket.connect({
@@ -34,9 +33,8 @@ websocket.connect({
         activeScene = document.getElementById(`${data.currentScene}`);
         activeScene.disabled = true;
 
-        return websocket.send('OBS Studio', 'GetStreamingStatus');
-    })
-    .then(data => {
+        // The streaming and BRB state arrive as replayed StreamStarted/StreamStopped and BrbEnabled/BrbDisabled
+        // events after subscribing
         let streamButton = document.getElementById('start_stream');
         streamButton.onclick = function () {
             if (!streamButton.classList.contains('streaming')) {
@@ -45,10 +43,6 @@ websocket.connect({
 
             websocket.send('OBS Studio', 'StartStopStreaming');
         };
-        if (data.streaming === true) {
-            streamButton.classList.toggle('streaming');
-            streamButton.textContent = "Stream beenden";
-        }
 
         return websocket.send('OBS Studio', 'GetSceneItemProperties', {'item': 'Overlay', 'scene-name': 'Live'});
     })
@@ -63,17 +57,6 @@ websocket.connect({
         }
 
         obs_finished = true;
-
-        return websocket.send('Heartrate', 'GetBrbStatus');
-    })
-    .then(data => {
-        if (!data.enabled) {
-            let brb_button = document.getElementById('auto_brb');
-            brb_button.classList.add('button_pressed');
-            brb_button.textContent = 'Auto BRB OFF';
-        }
-
-        streamheart_finished = true;
         show();
     })
     .catch(err => { // Promise convention dicates you have a catch on every chain.
@@ -81,8 +64,6 @@ websocket.connect({
             console.log("Error to connect to server: ", err);
         } else if (!obs_finished) {
             console.log("OBS closed", err);
-        } else if (!streamheart_finished) {
-            console.log("Streamheart closed", err);
         }
     });
 
@@ -138,6 +119,11 @@ websocket.on('UnsubscribedFrom', () => {
 })
 
 websocket.on('SwitchScenes', data => {
+    // A replayed event can arrive before the scene buttons exist
+    if (!activeScene) {
+        return;
+    }
+
     activeScene.disabled = false;
     let doc = document.getElementById(`${data.sceneName}`);
 
@@ -150,13 +136,13 @@ websocket.on('SwitchScenes', data => {
 
 websocket.on('StreamStarted', () => {
     let streamButton = document.getElementById('start_stream');
-    streamButton.classList.toggle('streaming');
+    streamButton.classList.add('streaming');
     streamButton.textContent = "Stream beenden";
 })
 
 websocket.on('StreamStopped', () => {
     let streamButton = document.getElementById('start_stream');
-    streamButton.classList.toggle('streaming');
+    streamButton.classList.remove('streaming');
     streamButton.textContent = "Go live";
 })
 
@@ -195,6 +181,11 @@ websocket.on('error', err => {
     console.error('Fehler:', err);
 });
 
+websocket.on('RequestRejected', err => {
+    const retry = err.retryAfter !== undefined ? ` Erneut versuchen in ${err.retryAfter} s.` : '';
+    console.warn(`Anfrage abgelehnt (${err.reason}).${retry}`);
+});
+
 async function show() {
     await sleep(600);
     document.getElementById('main').classList.toggle('show');
@@ -335,6 +335,12 @@ class Socket extends EventEmitter {
 
         if (message.status === 'error') {
           err = message;
+        } else if (message.status === 'rejected') {
+          // Rejected by the admission control of the middleware or after the deadline. The request wasn't handled,
+          // reason and retryAfter (seconds, if set) tell when to try again.
+          err = message;
+          debug('[rejected] %s %s, retry after %s s', message.messageId, message.reason, message.retryAfter);
+          this.emit('RequestRejected', message);
         } else {
           data = message;
         }